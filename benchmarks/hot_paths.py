@@ -0,0 +1,441 @@
+"""
+Benchmarks hermes' hot paths against local stand-ins for SSH, Docker, S3 and
+EC2, so that changes to the tunnel and transfer code can be measured.
+
+    python benchmarks/hot_paths.py [--runs 3] [--size-mb 64] [--json]
+                                   [--ssh-profile PROFILE]
+                                   [--baseline OLD.json] [BENCHMARK ...]
+
+Everything runs on localhost. The SSH and Docker stand-ins run in a forked
+child process, so they don't share hermes' GIL, and S3 and EC2 are patched
+into hermes in-process. Results are for comparing hermes versions on the
+same machine rather than predicting times against real swarms. Linux only.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import docker
+import paramiko
+import yaml
+
+from standins import S3StandIn, ec2_instance, serve
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# hermes keeps its config, caches and journals in ~/.hermes, so it's given a
+# home of its own before it's imported.
+HOME = tempfile.mkdtemp(prefix='hermes-bench-')
+os.environ['HOME'] = HOME
+sys.path.insert(0, ROOT)
+
+from hermes_cli.manager import Manager  # noqa: E402
+from hermes_cli.scripts.hermes import cli  # noqa: E402
+from hermes_cli.utils import CONFIG_DIR, MB, inventory  # noqa: E402
+
+
+STACK = 'BenchSwarm'
+
+BUCKET = 'hermes-bench'
+
+VOLUME_FILE_SIZE = 4 * MB
+
+CONFIG_SIZE = 1024
+
+# The SSH profile for every benchmark, from the command line, rather than
+# each command's own.
+SSH_PROFILE = {'name': None}
+
+
+class StandIns(object):
+    """
+    Starts the stand-ins, and configures hermes to use them.
+    """
+
+    def __init__(self, streamlocal=True, echo=False):
+        self.path = tempfile.mkdtemp(dir=HOME)
+        self.socket_path = os.path.join(self.path, 'docker.sock')
+        self.volume_root = os.path.join(self.path, 'volumes')
+        os.mkdir(self.volume_root)
+        key_filename = os.path.join(self.path, 'id_rsa')
+        paramiko.RSAKey.generate(2048).write_private_key_file(key_filename)
+
+        # Forked rather than spawned, which would run this module again.
+        context = multiprocessing.get_context('fork')
+        ready, ready_child = context.Pipe(duplex=False)
+        self.process = context.Process(
+            target=serve,
+            args=(
+                self.socket_path,
+                self.volume_root,
+                key_filename,
+                streamlocal,
+                echo,
+                ready_child,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+        ssh_port = ready.recv()
+
+        self.s3 = S3StandIn()
+        inventory._s3 = self.s3
+        Manager.describe_instances = classmethod(
+            lambda cls, cf_stack=None: [ec2_instance(STACK)],
+        )
+
+        config = {
+            's3_config_bucket': BUCKET,
+            'ssh_key_filename': key_filename,
+            'ssh_port': ssh_port,
+            'use_agent': False,
+            'backup_cache': False,
+            'docker_forwarding': 'auto' if streamlocal else 'socat',
+        }
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        with open(os.path.join(CONFIG_DIR, 'config.yml'), 'w') as conf_f:
+            yaml.safe_dump(config, conf_f)
+        Manager.config.update(config)
+        Manager.config['ssh_profile'] = SSH_PROFILE['name']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.process.terminate()
+        self.process.join()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def manager(self):
+        return Manager(ec2_instance(STACK))
+
+
+def hermes(*args):
+    """
+    Runs a hermes command in this process, with its output hidden.
+    """
+
+    if SSH_PROFILE['name']:
+        args = ('--ssh-profile', SSH_PROFILE['name']) + args
+    stderr = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            with contextlib.redirect_stderr(stderr):
+                cli.main(list(args), prog_name='hermes', standalone_mode=False)
+    except SystemExit as e:
+        if e.code:
+            raise RuntimeError('hermes {} failed: {}'.format(
+                ' '.join(args),
+                stderr.getvalue().strip(),
+            ))
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+
+def throughput(size, times):
+    return {
+        'mb': round(size / MB, 1),
+        'mb_per_s': round(size / MB / statistics.median(times), 1),
+        'seconds': [round(seconds, 3) for seconds in times],
+    }
+
+
+def latency(times):
+    times = sorted(times)
+    return {
+        'requests': len(times),
+        'median_ms': round(statistics.median(times) * 1000, 2),
+        'p95_ms': round(times[int(len(times) * 0.95)] * 1000, 2),
+    }
+
+
+def wall_time(times):
+    return {
+        'median_s': round(statistics.median(times), 3),
+        'seconds': [round(seconds, 3) for seconds in times],
+    }
+
+
+def echo_through(socket_path, size):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    block = os.urandom(MB)
+
+    def send():
+        for _ in range(size // MB):
+            sock.sendall(block)
+        sock.shutdown(socket.SHUT_WR)
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    received = 0
+    while True:
+        data = sock.recv(MB)
+        if not data:
+            break
+        received += len(data)
+    sender.join()
+    sock.close()
+    if received != size // MB * MB:
+        raise RuntimeError('Echoed {} of {} bytes'.format(received, size))
+
+
+def tunnel_throughput(options, streamlocal):
+    """
+    Bytes each way per second through open_docker_socket's tunnel, echoed
+    back by the far end.
+    """
+
+    size = options.size_mb * MB
+    with StandIns(streamlocal=streamlocal, echo=True) as stand_ins:
+        with stand_ins.manager() as manager:
+            echo_through(manager.socket_path, MB)
+            times = [
+                timed(echo_through, manager.socket_path, size)
+                for _ in range(options.runs)
+            ]
+        manager.disconnect_ssh()
+    return throughput(size, times)
+
+
+def docker_request_latency(options):
+    """
+    Round trip times of docker-py requests through the tunnel.
+    """
+
+    with StandIns() as stand_ins:
+        with stand_ins.manager() as manager:
+            api = manager.docker.api
+            api.ping()
+            times = [timed(api.ping) for _ in range(options.requests)]
+            manager.docker.close()
+        manager.disconnect_ssh()
+    return latency(times)
+
+
+def execute_round_trip(options):
+    """
+    Round trip times of Manager.execute for a command with no output.
+    """
+
+    with StandIns() as stand_ins:
+        manager = stand_ins.manager()
+        manager.connect_ssh()
+        manager.execute('true', echo=False)
+        times = [
+            timed(manager.execute, 'true', False)
+            for _ in range(options.requests)
+        ]
+        manager.disconnect_ssh()
+    return latency(times)
+
+
+def make_volume(stand_ins, volume_name, size):
+    path = os.path.join(stand_ins.volume_root, volume_name)
+    os.makedirs(path)
+    for i in range(max(size // VOLUME_FILE_SIZE, 1)):
+        with open(os.path.join(path, 'file{}'.format(i)), 'wb') as file_f:
+            file_f.write(os.urandom(min(size, VOLUME_FILE_SIZE)))
+
+
+def volume_transfer(options):
+    """
+    hermes volume backup to, and restore from, a local file, for a volume of
+    incompressible files.
+    """
+
+    size = options.size_mb * MB
+    with StandIns() as stand_ins:
+        make_volume(stand_ins, 'bench', size)
+        backup_file = os.path.join(stand_ins.path, 'bench.tar')
+
+        backup_times = []
+        for _ in range(options.runs):
+            if os.path.exists(backup_file):
+                os.remove(backup_file)
+            backup_times.append(timed(
+                hermes,
+                'volume', 'backup', STACK, 'bench', backup_file,
+            ))
+        backup_size = os.path.getsize(backup_file)
+
+        restore_times = []
+        restore_path = os.path.join(stand_ins.volume_root, 'bench-restore')
+        for _ in range(options.runs):
+            shutil.rmtree(restore_path, ignore_errors=True)
+            restore_times.append(timed(
+                hermes,
+                'volume', 'restore', STACK, 'bench-restore', backup_file,
+            ))
+
+    return {
+        'volume_backup': throughput(backup_size, backup_times),
+        'volume_restore': throughput(backup_size, restore_times),
+    }
+
+
+def config_restore_all(options):
+    """
+    hermes config restore --all, restoring every config from S3 backups.
+    """
+
+    with StandIns() as stand_ins:
+        for i in range(options.configs):
+            inventory.put_backup(
+                BUCKET,
+                'configs',
+                STACK,
+                'config-{}'.format(i),
+                os.urandom(CONFIG_SIZE),
+            )
+
+        api = docker.APIClient(base_url='unix://' + stand_ins.socket_path)
+        times = []
+        for _ in range(options.runs):
+            for config in api.configs():
+                api.remove_config(config['ID'])
+            times.append(timed(hermes, 'config', 'restore', '--all', STACK))
+        api.close()
+
+    result = wall_time(times)
+    result['configs'] = options.configs
+    return result
+
+
+# Each returns a dict of result names to results.
+BENCHMARKS = {
+    'tunnel': lambda options: {
+        'tunnel_streamlocal': tunnel_throughput(options, True),
+        'tunnel_socat': tunnel_throughput(options, False),
+    },
+    'docker_request': lambda options: {
+        'docker_request': docker_request_latency(options),
+    },
+    'execute': lambda options: {
+        'execute': execute_round_trip(options),
+    },
+    'volume': volume_transfer,
+    'config_restore_all': lambda options: {
+        'config_restore_all': config_restore_all(options),
+    },
+}
+
+# The headline figure of each kind of result, and whether more is better.
+HEADLINES = (
+    ('mb_per_s', 'MB/s', True),
+    ('median_ms', 'ms', False),
+    ('median_s', 's', False),
+)
+
+
+def hermes_version():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=ROOT,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        ).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_result(result, baseline=None):
+    for key, unit, more_is_better in HEADLINES:
+        if key in result:
+            break
+    line = '{:>10.2f} {:<4}'.format(result[key], unit)
+    if baseline and baseline.get(key):
+        change = (result[key] - baseline[key]) / baseline[key] * 100
+        line += ' {:>+7.1f}% {}'.format(
+            change,
+            'better' if (change > 0) == more_is_better else 'worse',
+        )
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n\n')[0].replace('\n', ' '),
+    )
+    parser.add_argument(
+        'benchmarks',
+        nargs='*',
+        metavar='BENCHMARK',
+        help='one or more of: {}'.format(', '.join(BENCHMARKS)),
+    )
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--configs', type=int, default=50)
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument(
+        '--ssh-profile',
+        help='SSH profile to use for every benchmark',
+    )
+    parser.add_argument(
+        '--baseline',
+        type=argparse.FileType('r'),
+        help='--json output of an earlier run to compare with',
+    )
+    options = parser.parse_args()
+    unknown = set(options.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmarks: {}'.format(', '.join(unknown)))
+
+    SSH_PROFILE['name'] = options.ssh_profile
+
+    baseline = {}
+    if options.baseline:
+        baseline = json.load(options.baseline)['results']
+
+    results = {}
+    try:
+        for name in options.benchmarks or BENCHMARKS:
+            results.update(BENCHMARKS[name](options))
+    finally:
+        shutil.rmtree(HOME, ignore_errors=True)
+
+    if options.json:
+        print(json.dumps({
+            'hermes': hermes_version(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'options': {
+                'runs': options.runs,
+                'size_mb': options.size_mb,
+                'requests': options.requests,
+                'configs': options.configs,
+                'ssh_profile': options.ssh_profile,
+            },
+            'results': results,
+        }, indent=2))
+    else:
+        for name, result in results.items():
+            print('{:<20} {}'.format(
+                name,
+                format_result(result, baseline.get(name)),
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,655 @@
+"""
+Local stand-ins for the services hermes talks to, for benchmarks: an SSH
+server which forwards the Docker socket, a Docker API server backed by local
+directories, an echo server, and in-memory S3 and EC2.
+
+They implement just enough for the benchmarked commands, and favour being
+fast over being faithful, so that benchmarks measure hermes rather than the
+stand-ins. serve() runs the SSH and Docker stand-ins in a process of their
+own. Helper container commands are run locally with bash, so these
+only work on Linux.
+"""
+
+import base64
+import datetime
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import socket
+import socketserver
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+import paramiko
+
+
+RELAY_SIZE = 256 * 1024
+
+EXEC_START_DELAY = 0.05
+
+OBJECT_PATH = r'^/(configs|secrets)/\w+$'
+
+STREAMLOCAL_CHANNEL = 'direct-streamlocal@openssh.com'
+
+# The commands the SSH stand-in will run, and their output and exit status.
+SSH_COMMANDS = {
+    'true': (b'', 0),
+    'socat -V': (b'socat version 1.7.4 (stand-in)\n', 0),
+}
+
+# What the stand-in reports for hermes' bootstrap command, after the line
+# echoing its version.
+BOOTSTRAP_OUTPUT = (
+    b'socat=1\n'
+    b'docker_socket=/var/run/docker.sock\n'
+    b'docker_api_version=1.41\n'
+    b'image=alpine\n'
+)
+
+logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+
+
+def relay(source, destination):
+    """
+    Copies from source to destination until source closes, then closes
+    destination for writing. Either may be a socket or a paramiko channel.
+    """
+
+    try:
+        while True:
+            data = source.recv(RELAY_SIZE)
+            if not data:
+                break
+            destination.sendall(data)
+    except (OSError, EOFError):
+        pass
+    try:
+        if isinstance(destination, paramiko.Channel):
+            destination.shutdown_write()
+        else:
+            destination.shutdown(socket.SHUT_WR)
+    except (OSError, EOFError):
+        pass
+
+
+def relay_both(channel, socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    upstream = threading.Thread(
+        target=relay,
+        args=(channel, sock),
+        daemon=True,
+    )
+    upstream.start()
+    relay(sock, channel)
+    upstream.join()
+    sock.close()
+
+
+def start_thread(target, *args):
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+class EchoStandIn(object):
+    """
+    Echoes back whatever is sent to socket_path, for measuring the tunnel on
+    its own.
+    """
+
+    def __init__(self, socket_path):
+        self.listen_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listen_sock.bind(socket_path)
+        self.listen_sock.listen()
+
+    def start(self):
+        start_thread(self._accept)
+        return self
+
+    def close(self):
+        self.listen_sock.close()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.listen_sock.accept()
+            except OSError:
+                return
+            start_thread(relay, sock, sock)
+
+
+class _SSHServer(paramiko.ServerInterface):
+    def __init__(self, stand_in):
+        self.stand_in = stand_in
+        self.streamlocal_ids = set()
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        if key == self.stand_in.client_key:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        if kind == STREAMLOCAL_CHANNEL and self.stand_in.streamlocal:
+            self.streamlocal_ids.add(chanid)
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        start_thread(self.stand_in.run, channel, command.decode('utf-8'))
+        return True
+
+
+class SSHStandIn(object):
+    """
+    An SSH server on localhost which only accepts client_key. Streamlocal
+    channels and "socat UNIX-CONNECT:... STDIO" are forwarded to socket_path,
+    whichever path they ask for. hermes' bootstrap command is answered with
+    BOOTSTRAP_OUTPUT. Other commands must be in SSH_COMMANDS.
+    """
+
+    def __init__(self, socket_path, client_key, streamlocal=True):
+        self.socket_path = socket_path
+        self.client_key = client_key
+        self.streamlocal = streamlocal
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.listen_sock = socket.socket()
+        self.listen_sock.bind(('127.0.0.1', 0))
+        self.listen_sock.listen()
+        self.port = self.listen_sock.getsockname()[1]
+        self.transports = []
+
+    def start(self):
+        start_thread(self._accept)
+        return self
+
+    def close(self):
+        self.listen_sock.close()
+        for transport in self.transports:
+            transport.close()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.listen_sock.accept()
+            except OSError:
+                return
+            start_thread(self._serve, sock)
+
+    def _serve(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = paramiko.Transport(sock)
+        # hermes asks for compression, and real servers allow it.
+        transport.use_compression(True)
+        transport.add_server_key(self.host_key)
+        self.transports.append(transport)
+        server = _SSHServer(self)
+        try:
+            transport.start_server(server=server)
+        except (paramiko.SSHException, EOFError, OSError):
+            return
+        # paramiko closes channels when they're garbage collected, so session
+        # channels are kept until they're closed.
+        sessions = []
+        while transport.is_active():
+            channel = transport.accept(timeout=1)
+            sessions = [session for session in sessions if not session.closed]
+            if not channel:
+                continue
+            if channel.get_id() in server.streamlocal_ids:
+                start_thread(relay_both, channel, self.socket_path)
+            else:
+                sessions.append(channel)
+
+    def run(self, channel, command):
+        if command.startswith('socat UNIX-CONNECT:'):
+            relay_both(channel, self.socket_path)
+            status = 0
+        elif command.startswith('echo bootstrap='):
+            version = command.split(';')[0][len('echo '):]
+            channel.sendall(version.encode('utf-8') + b'\n' + BOOTSTRAP_OUTPUT)
+            status = 0
+        elif command in SSH_COMMANDS:
+            output, status = SSH_COMMANDS[command]
+            channel.sendall(output)
+        else:
+            channel.sendall_stderr(
+                '{}: command not found\n'.format(command).encode('utf-8'),
+            )
+            status = 127
+        channel.send_exit_status(status)
+        # The client closes the channel once it has the exit status. Closing
+        # it here could beat paramiko's reply to the exec request, which the
+        # client would see as the request failing.
+        channel.shutdown_write()
+
+
+class _DockerServer(
+    socketserver.ThreadingMixIn,
+    socketserver.UnixStreamServer,
+):
+    daemon_threads = True
+
+
+class _DockerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_PUT(self):
+        self.route('PUT')
+
+    def do_DELETE(self):
+        self.route('DELETE')
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                yield self.rfile.read(length)
+
+    def read_json(self):
+        return json.loads(b''.join(self.read_body()) or b'{}')
+
+    def respond(self, status, body=None, headers=()):
+        data = b'' if body is None else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for header in headers:
+            self.send_header(*header)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def route(self, method):
+        url = urlparse(self.path)
+        path = re.sub(r'^/v[0-9.]+', '', url.path)
+        query = parse_qs(url.query)
+        docker = self.server.stand_in
+
+        if path == '/_ping':
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'OK')
+        elif path == '/version':
+            self.respond(200, {'ApiVersion': '1.41', 'Version': 'stand-in'})
+        elif path in ('/configs', '/secrets'):
+            self.respond(200, docker.objects[path[1:]])
+        elif path in ('/configs/create', '/secrets/create'):
+            spec = self.read_json()
+            new_object = docker.create_object(path.split('/')[1], spec)
+            self.respond(201, {'ID': new_object['ID']})
+        elif method == 'DELETE' and re.match(OBJECT_PATH, path):
+            _, kind, object_id = path.split('/')
+            docker.objects[kind] = [
+                docker_object for docker_object in docker.objects[kind]
+                if docker_object['ID'] != object_id
+            ]
+            self.respond(204)
+        elif path == '/volumes':
+            self.respond(200, {'Volumes': docker.list_volumes()})
+        elif path == '/containers/create':
+            container_id = docker.create_container(self.read_json())
+            self.respond(201, {'Id': container_id, 'Warnings': []})
+        else:
+            match = re.match(r'^/(containers|exec)/(\w+)(/\w+)?$', path)
+            if not match:
+                self.respond(404, {'message': 'not found: {}'.format(path)})
+                return
+            kind, object_id, action = match.groups()
+            if kind == 'containers':
+                self.container(method, object_id, action or '', query)
+            else:
+                self.exec_instance(object_id, action)
+
+    def container(self, method, container_id, action, query):
+        docker = self.server.stand_in
+        container = docker.containers.get(container_id)
+        if container is None:
+            self.respond(404, {'message': 'no such container'})
+        elif action == '' and method == 'DELETE':
+            docker.remove_container(container_id)
+            self.respond(204)
+        elif action == '/json':
+            self.respond(200, {
+                'Id': container_id,
+                'Config': container['spec'],
+                'State': {'Running': True},
+            })
+        elif action == '/start':
+            self.respond(204)
+        elif action == '/exec':
+            exec_id = uuid.uuid4().hex
+            docker.execs[exec_id] = {
+                'container': container,
+                'spec': self.read_json(),
+                'exit_code': None,
+            }
+            self.respond(201, {'Id': exec_id})
+        elif action == '/archive' and method == 'GET':
+            self.get_archive(container, query['path'][0])
+        elif action == '/archive':
+            self.put_archive(container, query['path'][0])
+        else:
+            self.respond(404, {'message': 'not found'})
+
+    def get_archive(self, container, path):
+        path = container['map_path'](path).rstrip('/')
+        stat = json.dumps({'name': os.path.basename(path)})
+        self.send_response(200)
+        self.send_header(
+            'X-Docker-Container-Path-Stat',
+            base64.b64encode(stat.encode('utf-8')).decode('ascii'),
+        )
+        self.send_header('Content-Type', 'application/x-tar')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        process = subprocess.Popen(
+            [
+                'tar',
+                '-C',
+                os.path.dirname(path),
+                '-cf',
+                '-',
+                os.path.basename(path),
+            ],
+            stdout=subprocess.PIPE,
+        )
+        for chunk in iter(lambda: process.stdout.read1(RELAY_SIZE), b''):
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+        self.wfile.write(b'0\r\n\r\n')
+        process.wait()
+
+    def put_archive(self, container, path):
+        path = container['map_path'](path)
+        process = subprocess.Popen(
+            ['tar', '-C', path, '-xf', '-'],
+            stdin=subprocess.PIPE,
+        )
+        for chunk in self.read_body():
+            process.stdin.write(chunk)
+        process.stdin.close()
+        if process.wait():
+            self.respond(500, {'message': 'tar failed'})
+        else:
+            self.respond(200)
+
+    def write_frame(self, stream_type, data):
+        self.wfile.write(struct.pack('>BxxxL', stream_type, len(data)) + data)
+
+    def exec_instance(self, exec_id, action):
+        docker_exec = self.server.stand_in.execs[exec_id]
+        if action == '/json':
+            self.respond(200, {
+                'ExitCode': docker_exec['exit_code'],
+                'Running': docker_exec['exit_code'] is None,
+            })
+            return
+
+        list(self.read_body())
+        spec = docker_exec['spec']
+        container = docker_exec['container']
+        args = [container['map_command'](arg) for arg in spec['Cmd']]
+        if args[0] == 'sh':
+            # The helper image's sh supports pipefail, but not every sh does.
+            args[0] = 'bash'
+        process = subprocess.Popen(
+            args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.send_response(101)
+        self.send_header('Content-Type', 'application/vnd.docker.raw-stream')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Upgrade', 'tcp')
+        self.end_headers()
+        self.wfile.flush()
+        # Output sent along with the headers can end up in docker-py's buffer
+        # for reading them, where it's lost. Real daemons take longer than
+        # this to start the process anyway.
+        time.sleep(EXEC_START_DELAY)
+
+        # stderr is sent after stdout, read meanwhile so it can't fill up.
+        stderr = []
+        stderr_reader = start_thread(
+            lambda: stderr.append(process.stderr.read()),
+        )
+        for chunk in iter(lambda: process.stdout.read1(RELAY_SIZE), b''):
+            if spec.get('AttachStdout', True):
+                self.write_frame(1, chunk)
+        stderr_reader.join()
+        if stderr[0] and spec.get('AttachStderr', True):
+            self.write_frame(2, stderr[0])
+        docker_exec['exit_code'] = process.wait()
+        self.close_connection = True
+
+
+class DockerStandIn(object):
+    """
+    A Docker API server listening on socket_path. Volumes are directories
+    in volume_root, and containers' commands run locally with /mnt mapped to
+    volume_root and /tmp to a directory of their own.
+    """
+
+    def __init__(self, socket_path, volume_root):
+        self.socket_path = socket_path
+        self.volume_root = volume_root
+        self.objects = {'configs': [], 'secrets': []}
+        self.containers = {}
+        self.execs = {}
+        self.server = _DockerServer(socket_path, _DockerHandler)
+        self.server.stand_in = self
+
+    def start(self):
+        start_thread(self.server.serve_forever)
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for container_id in list(self.containers):
+            self.remove_container(container_id)
+
+    def volume_path(self, volume_name):
+        path = os.path.join(self.volume_root, volume_name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def list_volumes(self):
+        return [
+            {'Name': name, 'Driver': 'cloudstor:aws', 'Labels': {}}
+            for name in sorted(os.listdir(self.volume_root))
+        ]
+
+    def create_object(self, kind, spec):
+        new_object = {
+            'ID': uuid.uuid4().hex,
+            'Spec': spec,
+            'UpdatedAt': '2018-01-01T00:00:00Z',
+        }
+        if kind == 'secrets':
+            new_object['Spec'] = dict(spec)
+            new_object['Spec'].pop('Data', None)
+        self.objects[kind].append(new_object)
+        return new_object
+
+    def create_container(self, spec):
+        container_id = uuid.uuid4().hex
+        for bind in spec.get('HostConfig', {}).get('Binds') or []:
+            self.volume_path(bind.split(':')[0])
+        tmp_dir = tempfile.mkdtemp(prefix='hermes-bench-tmp-')
+
+        paths = {'/mnt': self.volume_root, '/tmp': tmp_dir}
+
+        def map_path(path):
+            return re.sub(
+                r'^(/mnt|/tmp)(?=/|$)',
+                lambda match: paths[match.group(1)],
+                path,
+            )
+
+        def map_command(arg):
+            return re.sub(
+                r'(?<![\w/])(/mnt|/tmp)(?=[/\s]|$)',
+                lambda match: paths[match.group(1)],
+                arg,
+            )
+
+        self.containers[container_id] = {
+            'spec': spec,
+            'tmp_dir': tmp_dir,
+            'map_path': map_path,
+            'map_command': map_command,
+        }
+        return container_id
+
+    def remove_container(self, container_id):
+        container = self.containers.pop(container_id)
+        shutil.rmtree(container['tmp_dir'], ignore_errors=True)
+
+
+class _S3Paginator(object):
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def paginate(self, Bucket, Prefix='', Delimiter=None):
+        contents = []
+        prefixes = set()
+        for (bucket, key), s3_object in sorted(self.s3.objects.items()):
+            if bucket != Bucket or not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                prefixes.add(Prefix + rest.split(Delimiter)[0] + Delimiter)
+                continue
+            contents.append({
+                'Key': key,
+                'Size': len(s3_object['data']),
+                'LastModified': s3_object['modified'],
+            })
+        yield {
+            'Contents': contents,
+            'CommonPrefixes': [{'Prefix': prefix} for prefix in prefixes],
+        }
+
+
+class _S3Object(object):
+    def __init__(self, s3, bucket, key):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+
+    def put(self, **kwargs):
+        return self.s3.put_object(Bucket=self.bucket, Key=self.key, **kwargs)
+
+
+class S3StandIn(object):
+    """
+    An in-memory stand-in for both the S3 resource and its client, with the
+    calls hermes makes for configs and secrets.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.meta = self
+        self.client = self
+
+    def Object(self, bucket, key):
+        return _S3Object(self, bucket, key)
+
+    def get_paginator(self, operation):
+        return _S3Paginator(self)
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+        data = Body if isinstance(Body, bytes) else Body.read()
+        etag = '"{}"'.format(hashlib.md5(data).hexdigest())
+        self.objects[(Bucket, Key)] = {
+            'data': data,
+            'etag': etag,
+            'metadata': Metadata or {},
+            'modified': datetime.datetime.now(datetime.timezone.utc),
+        }
+        return {'ETag': etag}
+
+    def head_object(self, Bucket, Key):
+        s3_object = self.objects[(Bucket, Key)]
+        return {
+            'ContentLength': len(s3_object['data']),
+            'ETag': s3_object['etag'],
+            'Metadata': s3_object['metadata'],
+        }
+
+    def get_object(self, Bucket, Key, **kwargs):
+        response = self.head_object(Bucket, Key)
+        response['Body'] = io.BytesIO(self.objects[(Bucket, Key)]['data'])
+        return response
+
+
+def serve(socket_path, volume_root, client_key_file, streamlocal, echo, ready):
+    """
+    Runs the SSH stand-in, forwarding to a Docker or echo stand-in, and sends
+    its port to the ready pipe. Meant to be the target of a process of its
+    own, so the stand-ins don't compete with hermes for the GIL.
+    """
+
+    if echo:
+        EchoStandIn(socket_path).start()
+    else:
+        DockerStandIn(socket_path, volume_root).start()
+    ssh = SSHStandIn(
+        socket_path,
+        paramiko.RSAKey(filename=client_key_file),
+        streamlocal,
+    ).start()
+    ready.send(ssh.port)
+    threading.Event().wait()
+
+
+def ec2_instance(stack, instance_id='i-0123456789abcdef0'):
+    """
+    Returns a describe_instances result for a manager on localhost.
+    """
+
+    return {
+        'InstanceId': instance_id,
+        'LaunchTime': datetime.datetime(2018, 1, 1),
+        'PublicDnsName': '127.0.0.1',
+        'State': {'Name': 'running'},
+        'Tags': [
+            {'Key': 'aws:cloudformation:stack-name', 'Value': stack},
+            {'Key': 'swarm-node-type', 'Value': 'manager'},
+        ],
+    }
@@ -0,0 +1,121 @@
+"""
+Measures how long hermes takes to start for a few commands, and checks that
+commands which don't need boto3, docker or paramiko don't import them.
+
+    python benchmarks/startup.py [--runs 10] [--max-ms 400] [--json]
+
+Exits with status 1 if a command imports a module it shouldn't, or if
+--max-ms is given and a command's median start time is over it.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('boto3', 'docker', 'paramiko')
+
+# Arguments, and the heavy modules which that command mustn't import.
+CASES = (
+    (['--help'], HEAVY_MODULES),
+    (['configure', '--help'], HEAVY_MODULES),
+    (['agent', '--help'], HEAVY_MODULES),
+    (['exec', '--help'], ('boto3', 'docker')),
+    (['config', '--help'], ('boto3', 'docker')),
+    (['volume', '--help'], ('boto3',)),
+)
+
+# Runs hermes in a child process and reports which heavy modules it loaded.
+CHILD = """
+import atexit, json, sys
+atexit.register(lambda: sys.stderr.write('\\n' + json.dumps(
+    [m for m in {modules!r} if m in sys.modules]
+)))
+from hermes_cli.scripts.hermes import cli
+cli({args!r}, prog_name='hermes')
+"""
+
+
+def run(args):
+    started = time.time()
+    result = subprocess.run(
+        [
+            sys.executable,
+            '-c',
+            CHILD.format(modules=HEAVY_MODULES, args=args),
+        ],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    elapsed = time.time() - started
+    return elapsed, json.loads(result.stderr.decode().splitlines()[-1])
+
+
+def interpreter_start():
+    started = time.time()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    return time.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0],
+    )
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-ms', type=float)
+    parser.add_argument('--json', action='store_true')
+    options = parser.parse_args()
+
+    baseline = statistics.median(
+        interpreter_start() for _ in range(options.runs)
+    )
+    results = []
+    for args, forbidden in CASES:
+        times = []
+        for _ in range(options.runs):
+            elapsed, loaded = run(args)
+            times.append(elapsed)
+        results.append({
+            'command': ' '.join(['hermes'] + args),
+            'median_ms': round(statistics.median(times) * 1000, 1),
+            'min_ms': round(min(times) * 1000, 1),
+            'loaded': loaded,
+            'unexpected': sorted(set(loaded) & set(forbidden)),
+        })
+
+    failed = [
+        result for result in results
+        if result['unexpected']
+        or (options.max_ms and result['median_ms'] > options.max_ms)
+    ]
+
+    if options.json:
+        print(json.dumps({
+            'python_ms': round(baseline * 1000, 1),
+            'runs': options.runs,
+            'results': results,
+        }, indent=2))
+    else:
+        print('python -c pass: {:.1f} ms'.format(baseline * 1000))
+        for result in results:
+            print('{:<24} {:>8.1f} ms  loaded: {}{}'.format(
+                result['command'],
+                result['median_ms'],
+                ', '.join(result['loaded']) or '-',
+                '  UNEXPECTED: {}'.format(', '.join(result['unexpected']))
+                if result['unexpected'] else '',
+            ))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
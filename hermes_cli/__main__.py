@@ -0,0 +1,4 @@
+from hermes_cli.scripts.hermes import cli
+
+
+cli()
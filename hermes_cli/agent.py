@@ -0,0 +1,172 @@
+import json
+import os
+import socket
+import threading
+import time
+
+from hermes_cli.manager import Manager
+from hermes_cli.utils.agent import AGENT_SOCKET, DEFAULT_IDLE_TIMEOUT
+
+
+REAP_INTERVAL = 10
+
+
+class Agent(object):
+    """
+    Owns long-lived Manager connections and Docker tunnels, keyed by swarm
+    name, and hands out their socket paths over a local control socket.
+    """
+
+    def __init__(
+        self,
+        socket_path=AGENT_SOCKET,
+        idle_timeout=DEFAULT_IDLE_TIMEOUT,
+    ):
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.managers = {}
+        self.last_used = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._swarm_locks = {}
+        self._stopping = threading.Event()
+
+    def serve(self):
+        # Tunnels opened by the agent must not be handed back to the agent.
+        Manager.configure({'use_agent': False})
+
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        listen_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listen_sock.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        listen_sock.listen()
+        listen_sock.settimeout(1)
+
+        threading.Thread(target=self._reap, daemon=True).start()
+
+        try:
+            while not self._stopping.is_set():
+                try:
+                    connection, _ = listen_sock.accept()
+                except socket.timeout:
+                    continue
+                threading.Thread(
+                    target=self._handle,
+                    args=(connection,),
+                    daemon=True,
+                ).start()
+        finally:
+            listen_sock.close()
+            os.unlink(self.socket_path)
+            with self._lock:
+                for swarm_name in list(self.managers):
+                    self._evict(swarm_name)
+
+    def _handle(self, connection):
+        with connection:
+            try:
+                request = json.loads(
+                    connection.makefile('rb').readline().decode('utf-8')
+                )
+                handler = getattr(
+                    self,
+                    'do_{}'.format(request.pop('command')),
+                    None,
+                )
+                if handler:
+                    response = handler(**request)
+                else:
+                    response = {'error': 'Unknown command'}
+            except SystemExit:
+                response = {'error': 'Manager not found'}
+            except Exception as e:
+                response = {'error': str(e)}
+            connection.sendall(
+                json.dumps(response, default=str).encode('utf-8') + b'\n'
+            )
+
+    def do_tunnel(self, swarm_name):
+        # Connecting can take a while, so it only holds up other requests
+        # for the same swarm.
+        with self._lock:
+            swarm_lock = self._swarm_locks.setdefault(
+                swarm_name,
+                threading.Lock(),
+            )
+        with swarm_lock:
+            with self._lock:
+                manager = self.managers.get(swarm_name)
+                if manager and not self._alive(manager):
+                    self._evict(swarm_name)
+                    manager = None
+            if not manager:
+                manager = Manager.find(swarm_name)
+                manager.open_docker_socket()
+            with self._lock:
+                self.managers[swarm_name] = manager
+                self.last_used[swarm_name] = time.time()
+        return {
+            'instance': manager.meta,
+            'socket_path': manager.socket_path,
+        }
+
+    def do_status(self):
+        now = time.time()
+        with self._lock:
+            swarms = [
+                {
+                    'swarm_name': swarm_name,
+                    'dns_name': manager.dns_name,
+                    'connections': len(manager.tunnel.connections),
+                    'idle': int(now - self._last_active(swarm_name)),
+                }
+                for swarm_name, manager in sorted(self.managers.items())
+            ]
+        return {
+            'pid': os.getpid(),
+            'uptime': int(now - self.started),
+            'idle_timeout': self.idle_timeout,
+            'swarms': swarms,
+        }
+
+    def do_stop(self):
+        self._stopping.set()
+        return {'pid': os.getpid()}
+
+    def _alive(self, manager):
+        transport = manager.ssh_client.get_transport()
+        return (
+            transport is not None
+            and transport.is_active()
+            and manager.tunnel.alive
+        )
+
+    def _last_active(self, swarm_name):
+        return max(
+            self.last_used[swarm_name],
+            self.managers[swarm_name].tunnel.last_active,
+        )
+
+    def _evict(self, swarm_name):
+        manager = self.managers.pop(swarm_name)
+        self.last_used.pop(swarm_name)
+        try:
+            manager.close_docker_socket()
+            manager.disconnect_ssh()
+        except Exception:
+            pass
+
+    def _reap(self):
+        while not self._stopping.wait(REAP_INTERVAL):
+            now = time.time()
+            with self._lock:
+                for swarm_name, manager in list(self.managers.items()):
+                    if manager.tunnel.connections:
+                        continue
+                    if (
+                        now - self._last_active(swarm_name) > self.idle_timeout
+                        or not self._alive(manager)
+                    ):
+                        self._evict(swarm_name)
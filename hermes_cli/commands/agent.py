@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+import time
+
+import click
+
+from hermes_cli.scripts.hermes import cli
+from hermes_cli.utils.agent import DEFAULT_IDLE_TIMEOUT, agent_request
+
+
+@cli.group()
+def agent():
+    pass
+
+
+@agent.command()
+@click.pass_context
+@click.option('--idle-timeout', '-t', type=int, default=DEFAULT_IDLE_TIMEOUT)
+def start(ctx, idle_timeout):
+    if agent_request('status', timeout=5):
+        click.echo("hermes agent is already running")
+        return
+
+    config_dir = ctx.parent.parent.config_dir
+    os.makedirs(config_dir, exist_ok=True)
+    with open(os.path.join(config_dir, 'agent.log'), 'ab') as log:
+        subprocess.Popen(
+            [
+                sys.executable,
+                '-m',
+                'hermes_cli',
+                'agent',
+                'run',
+                '--idle-timeout',
+                str(idle_timeout),
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+
+    for _ in range(50):
+        status = agent_request('status', timeout=5)
+        if status:
+            click.echo("hermes agent started (pid {})".format(status['pid']))
+            return
+        time.sleep(0.1)
+    click.echo("Error: hermes agent failed to start", err=True)
+    sys.exit(1)
+
+
+@agent.command()
+@click.option('--idle-timeout', '-t', type=int, default=DEFAULT_IDLE_TIMEOUT)
+def run(idle_timeout):
+    # Imported here so that the other agent commands don't load paramiko.
+    from hermes_cli.agent import Agent
+    Agent(idle_timeout=idle_timeout).serve()
+
+
+@agent.command()
+def stop():
+    response = agent_request('stop', timeout=5)
+    if not response:
+        click.echo("hermes agent is not running", err=True)
+        sys.exit(1)
+    click.echo("hermes agent stopped (pid {})".format(response['pid']))
+
+
+@agent.command()
+def status():
+    response = agent_request('status', timeout=5)
+    if not response:
+        click.echo("hermes agent is not running")
+        sys.exit(1)
+
+    click.echo(
+        "hermes agent running (pid {pid}, up {uptime}s, "
+        "idle timeout {idle_timeout}s)".format(**response)
+    )
+    for swarm in response['swarms']:
+        click.echo(
+            "{swarm_name:<30} {dns_name}  {connections} connections  "
+            "idle {idle}s".format(**swarm)
+        )
@@ -1,81 +1,32 @@
 import sys
 
-import boto3
 import click
-import dateutil
 
 from hermes_cli.manager import Manager
 from hermes_cli.scripts.hermes import cli
-
-
-s3 = boto3.resource('s3')
-
-
-def config_s3_path(swarm_name, config_name=''):
-    return 'swarms/{}/configs/{}'.format(swarm_name, config_name)
-
-
-def s3_config_bucket(ctx):
-    config_bucket = ctx.parent.parent.config.get('s3_config_bucket')
-    if not config_bucket:
-        click.echo(
-            'No s3_config_bucket configured! Please run hermes configure',
-            err=True,
-        )
-        sys.exit(1)
-    return config_bucket
+from hermes_cli.utils import inventory
+from hermes_cli.utils.inventory import s3_config_bucket
+from hermes_cli.utils.restore import DEFAULT_JOBS, restore_backups
+from hermes_cli.utils.sync import read_directory, sync_items
 
 
 def get_configs(ctx, swarm_name, manager=None, skip_backups=False):
-    config_bucket = s3_config_bucket(ctx)
-    configs = {
-        'backups': {},
-        'originals': {},
-    }
-
-    if not skip_backups:
-        for s3_obj in s3.Bucket(config_bucket).objects.filter(
-            Prefix=config_s3_path(swarm_name),
-        ):
-            config_name = s3_obj.key.split('/')[-1]
-            configs['backups'][config_name] = {
-                'id': '-',
-                'name': config_name,
-                'backup': '-',
-                'modified': s3_obj.last_modified,
-            }
-
-    def _get_originals(manager):
-        for config in manager.docker.configs.list():
-            configs['originals'][config.name] = {
-                'id': config.id,
-                'name': config.name,
-                'backup': '*' if config.name in configs['backups'] else '!',
-                'modified': dateutil.parser.parse(config.attrs['UpdatedAt']),
-            }
-
-    if manager:
-        _get_originals(manager)
-    else:
-        with Manager.find(swarm_name) as manager:
-            _get_originals(manager)
-
-    return configs
+    return inventory.get_inventory(
+        ctx,
+        'configs',
+        swarm_name,
+        manager,
+        skip_backups,
+    )
 
 
 def create_config(swarm_name, config_name, config_data):
     with Manager.find(swarm_name) as manager:
-        manager.docker.configs.create(
-            name=config_name,
-            data=config_data,
-        )
+        inventory.create_original(manager, 'configs', config_name, config_data)
 
 
 def get_backup(ctx, swarm_name, config_name):
-    return s3.Object(
-        s3_config_bucket(ctx),
-        config_s3_path(swarm_name, config_name),
-    ).get()['Body'].read()
+    return inventory.get_backup(ctx, 'configs', swarm_name, config_name)
 
 
 @cli.group()
@@ -98,13 +49,12 @@ def create(ctx, swarm_name, config_name, config_file, no_backup):
     create_config(swarm_name, config_name, config_data)
 
     if not no_backup:
-        s3.Object(
+        inventory.put_backup(
             config_bucket,
-            config_s3_path(swarm_name, config_name),
-        ).put(
-            ServerSideEncryption='aws:kms',
-            ACL='private',
-            Body=config_data,
+            'configs',
+            swarm_name,
+            config_name,
+            config_data,
         )
 
 
@@ -113,29 +63,87 @@ def create(ctx, swarm_name, config_name, config_file, no_backup):
 @click.argument('swarm-name')
 @click.argument('config-names', nargs=-1)
 @click.option('--all', 'restore_all', is_flag=True)
-def restore(ctx, swarm_name, config_names, restore_all):
-    configs = get_configs(ctx, swarm_name)
+@click.option(
+    '--jobs',
+    '-j',
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+)
+def restore(ctx, swarm_name, config_names, restore_all, jobs):
+    with Manager.find(swarm_name) as manager:
+        configs = get_configs(ctx, swarm_name, manager)
+
+        if restore_all:
+            config_names = configs['backups'].keys()
 
-    if restore_all:
-        config_names = configs['backups'].keys()
-
-    count = 0
-    for config_name in config_names:
-        if config_name in configs['originals']:
-            click.echo(
-                "Warning: Original config {} exists. Skipping restore.".format(
-                    config_name,
-                ),
-                err=True,
+        restore_names = []
+        for config_name in config_names:
+            if config_name in configs['originals']:
+                click.echo(
+                    "Warning: Original config {} exists. "
+                    "Skipping restore.".format(config_name),
+                    err=True,
+                )
+                continue
+            restore_names.append(config_name)
+
+        def _create(config_name, config_data):
+            inventory.create_original(
+                manager,
+                'configs',
+                config_name,
+                config_data,
             )
-            continue
+            click.echo(config_name)
+
+        restored, failed = restore_backups(
+            restore_names,
+            lambda config_name: get_backup(ctx, swarm_name, config_name),
+            _create,
+            jobs=jobs,
+        )
+
+    for config_name, error in failed:
+        click.echo(
+            "Error: Couldn't restore config {}: {}".format(config_name, error),
+            err=True,
+        )
+
+    click.echo("Successfully restored {} configs".format(len(restored)))
+    if failed:
+        sys.exit(1)
 
-        config_data = get_backup(ctx, swarm_name, config_name)
-        create_config(swarm_name, config_name, config_data)
-        click.echo(config_name)
-        count += 1
 
-    click.echo("Successfully restored {} configs".format(count))
+@config.command()
+@click.pass_context
+@click.argument('swarm-name')
+@click.argument(
+    'directory',
+    type=click.Path(exists=True, file_okay=False),
+)
+@click.option('-n', '--no-backup', is_flag=True)
+@click.option('--dry-run', is_flag=True)
+@click.option(
+    '--jobs',
+    '-j',
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+)
+def sync(ctx, swarm_name, directory, no_backup, dry_run, jobs):
+    config_items = read_directory(directory)
+    with Manager.find(swarm_name) as manager:
+        differs = sync_items(
+            ctx,
+            'configs',
+            swarm_name,
+            manager,
+            config_items,
+            backup=not no_backup,
+            dry_run=dry_run,
+            jobs=jobs,
+        )
+    if differs:
+        sys.exit(1)
 
 
 @config.command()
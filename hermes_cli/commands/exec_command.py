@@ -1,20 +1,134 @@
-import click
+import fnmatch
+import os
 import subprocess
 import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import click
 
 from hermes_cli.manager import Manager
 from hermes_cli.scripts.hermes import cli
 
 
+DEFAULT_JOBS = 4
+
+output_lock = threading.Lock()
+
+
+def select_swarms(selector):
+    """
+    Expands a comma separated list of swarm names and glob patterns into
+    swarm names, matching patterns against the stacks of running managers.
+    """
+
+    swarm_names = []
+    stacks = None
+    for pattern in selector.split(','):
+        if not any(char in pattern for char in '*?['):
+            matches = [pattern]
+        else:
+            if stacks is None:
+                stacks = sorted(set(
+                    manager.stack for manager in Manager.list()
+                    if manager.stack
+                ))
+            matches = fnmatch.filter(stacks, pattern)
+        for swarm_name in matches:
+            if swarm_name not in swarm_names:
+                swarm_names.append(swarm_name)
+    return swarm_names
+
+
+def docker_env(manager):
+    env = dict(os.environ)
+    env['DOCKER_HOST'] = manager.docker_host
+    return env
+
+
+def echo_prefixed(swarm_name, stream, err=False):
+    for line in iter(stream.readline, b''):
+        with output_lock:
+            click.echo(
+                "[{}] {}".format(
+                    swarm_name,
+                    line.decode('utf-8', 'replace').rstrip('\n'),
+                ),
+                err=err,
+            )
+
+
+def exit_status(returncode):
+    # Popen reports a death by signal N as -N, which would lose to 0 in
+    # max(), so it's reported as 128 + N like shells do.
+    return 128 - returncode if returncode < 0 else returncode
+
+
+def exec_prefixed(swarm_name, command):
+    try:
+        with Manager.find(swarm_name) as manager:
+            process = subprocess.Popen(
+                command,
+                env=docker_env(manager),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            stderr_thread = threading.Thread(
+                target=echo_prefixed,
+                args=(swarm_name, process.stderr, True),
+            )
+            stderr_thread.start()
+            echo_prefixed(swarm_name, process.stdout)
+            stderr_thread.join()
+            return exit_status(process.wait())
+    except SystemExit:
+        return 1
+    except Exception as e:
+        with output_lock:
+            click.echo("[{}] Error: {}".format(swarm_name, e), err=True)
+        return 1
+
+
 @cli.command(name="exec")
-@click.argument('swarm-name', required=True)
+@click.argument('swarm-names', required=True)
 @click.argument('command', nargs=-1)
-def exec_command(swarm_name, command):
-    with Manager.find(swarm_name):
-        exec_result = subprocess.call(
-            command,
-            stdin=click.get_text_stream('stdin'),
-            stdout=click.get_text_stream('stdout'),
-        )
-
-    sys.exit(exec_result)
+@click.option(
+    '--jobs',
+    '-j',
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+)
+def exec_command(swarm_names, command, jobs):
+    swarm_names = select_swarms(swarm_names)
+    if not swarm_names:
+        click.echo("Error: No swarms matched", err=True)
+        sys.exit(1)
+
+    if len(swarm_names) == 1:
+        with Manager.find(swarm_names[0]) as manager:
+            exec_result = subprocess.call(
+                command,
+                env=docker_env(manager),
+                stdin=click.get_text_stream('stdin'),
+                stdout=click.get_text_stream('stdout'),
+            )
+        sys.exit(exit_status(exec_result))
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        exec_results = list(executor.map(
+            lambda swarm_name: exec_prefixed(swarm_name, command),
+            swarm_names,
+        ))
+
+    for swarm_name, exec_result in zip(swarm_names, exec_results):
+        if exec_result:
+            click.echo(
+                "Error: {} exited with status {}".format(
+                    swarm_name,
+                    exec_result,
+                ),
+                err=True,
+            )
+    sys.exit(max(exec_results))
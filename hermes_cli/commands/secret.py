@@ -1,81 +1,32 @@
 import sys
 
-import boto3
 import click
-import dateutil
 
 from hermes_cli.manager import Manager
 from hermes_cli.scripts.hermes import cli
-
-
-s3 = boto3.resource('s3')
-
-
-def secret_s3_path(swarm_name, secret_name=''):
-    return 'swarms/{}/secrets/{}'.format(swarm_name, secret_name)
-
-
-def s3_config_bucket(ctx):
-    config_bucket = ctx.parent.parent.config.get('s3_config_bucket')
-    if not config_bucket:
-        click.echo(
-            'No s3_config_bucket configured! Please run hermes configure',
-            err=True,
-        )
-        sys.exit(1)
-    return config_bucket
+from hermes_cli.utils import inventory
+from hermes_cli.utils.inventory import s3_config_bucket
+from hermes_cli.utils.restore import DEFAULT_JOBS, restore_backups
+from hermes_cli.utils.sync import read_directory, sync_items
 
 
 def get_secrets(ctx, swarm_name, manager=None, skip_backups=False):
-    config_bucket = s3_config_bucket(ctx)
-    secrets = {
-        'backups': {},
-        'originals': {},
-    }
-
-    if not skip_backups:
-        for s3_obj in s3.Bucket(config_bucket).objects.filter(
-            Prefix=secret_s3_path(swarm_name),
-        ):
-            secret_name = s3_obj.key.split('/')[-1]
-            secrets['backups'][secret_name] = {
-                'id': '-',
-                'name': secret_name,
-                'backup': '-',
-                'modified': s3_obj.last_modified,
-            }
-
-    def _get_originals(manager):
-        for secret in manager.docker.secrets.list():
-            secrets['originals'][secret.name] = {
-                'id': secret.id,
-                'name': secret.name,
-                'backup': '*' if secret.name in secrets['backups'] else '!',
-                'modified': dateutil.parser.parse(secret.attrs['UpdatedAt']),
-            }
-
-    if manager:
-        _get_originals(manager)
-    else:
-        with Manager.find(swarm_name) as manager:
-            _get_originals(manager)
-
-    return secrets
+    return inventory.get_inventory(
+        ctx,
+        'secrets',
+        swarm_name,
+        manager,
+        skip_backups,
+    )
 
 
 def create_secret(swarm_name, secret_name, secret_data):
     with Manager.find(swarm_name) as manager:
-        manager.docker.secrets.create(
-            name=secret_name,
-            data=secret_data,
-        )
+        inventory.create_original(manager, 'secrets', secret_name, secret_data)
 
 
 def get_backup(ctx, swarm_name, secret_name):
-    return s3.Object(
-        s3_config_bucket(ctx),
-        secret_s3_path(swarm_name, secret_name),
-    ).get()['Body'].read()
+    return inventory.get_backup(ctx, 'secrets', swarm_name, secret_name)
 
 
 @cli.group()
@@ -98,13 +49,12 @@ def create(ctx, swarm_name, secret_name, secret_file, no_backup):
     create_secret(swarm_name, secret_name, secret_data)
 
     if not no_backup:
-        s3.Object(
+        inventory.put_backup(
             config_bucket,
-            secret_s3_path(swarm_name, secret_name),
-        ).put(
-            ServerSideEncryption='aws:kms',
-            ACL='private',
-            Body=secret_data,
+            'secrets',
+            swarm_name,
+            secret_name,
+            secret_data,
         )
 
 
@@ -113,29 +63,87 @@ def create(ctx, swarm_name, secret_name, secret_file, no_backup):
 @click.argument('swarm-name')
 @click.argument('secret-names', nargs=-1)
 @click.option('--all', 'restore_all', is_flag=True)
-def restore(ctx, swarm_name, secret_names, restore_all):
-    secrets = get_secrets(ctx, swarm_name)
+@click.option(
+    '--jobs',
+    '-j',
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+)
+def restore(ctx, swarm_name, secret_names, restore_all, jobs):
+    with Manager.find(swarm_name) as manager:
+        secrets = get_secrets(ctx, swarm_name, manager)
+
+        if restore_all:
+            secret_names = secrets['backups'].keys()
 
-    if restore_all:
-        secret_names = secrets['backups'].keys()
-
-    count = 0
-    for secret_name in secret_names:
-        if secret_name in secrets['originals']:
-            click.echo(
-                "Warning: Original secret {} exists. Skipping restore.".format(
-                    secret_name,
-                ),
-                err=True,
+        restore_names = []
+        for secret_name in secret_names:
+            if secret_name in secrets['originals']:
+                click.echo(
+                    "Warning: Original secret {} exists. "
+                    "Skipping restore.".format(secret_name),
+                    err=True,
+                )
+                continue
+            restore_names.append(secret_name)
+
+        def _create(secret_name, secret_data):
+            inventory.create_original(
+                manager,
+                'secrets',
+                secret_name,
+                secret_data,
             )
-            continue
+            click.echo(secret_name)
+
+        restored, failed = restore_backups(
+            restore_names,
+            lambda secret_name: get_backup(ctx, swarm_name, secret_name),
+            _create,
+            jobs=jobs,
+        )
+
+    for secret_name, error in failed:
+        click.echo(
+            "Error: Couldn't restore secret {}: {}".format(secret_name, error),
+            err=True,
+        )
+
+    click.echo("Successfully restored {} secrets".format(len(restored)))
+    if failed:
+        sys.exit(1)
 
-        secret_data = get_backup(ctx, swarm_name, secret_name)
-        create_secret(swarm_name, secret_name, secret_data)
-        click.echo(secret_name)
-        count += 1
 
-    click.echo("Successfully restored {} secrets".format(count))
+@secret.command()
+@click.pass_context
+@click.argument('swarm-name')
+@click.argument(
+    'directory',
+    type=click.Path(exists=True, file_okay=False),
+)
+@click.option('-n', '--no-backup', is_flag=True)
+@click.option('--dry-run', is_flag=True)
+@click.option(
+    '--jobs',
+    '-j',
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+)
+def sync(ctx, swarm_name, directory, no_backup, dry_run, jobs):
+    secret_items = read_directory(directory)
+    with Manager.find(swarm_name) as manager:
+        differs = sync_items(
+            ctx,
+            'secrets',
+            swarm_name,
+            manager,
+            secret_items,
+            backup=not no_backup,
+            dry_run=dry_run,
+            jobs=jobs,
+        )
+    if differs:
+        sys.exit(1)
 
 
 @secret.command()
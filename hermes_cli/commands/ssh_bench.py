@@ -0,0 +1,156 @@
+import os
+import statistics
+import sys
+import time
+
+import click
+import yaml
+
+from hermes_cli.manager import Manager
+from hermes_cli.scripts.hermes import cli
+from hermes_cli.ssh_profiles import SSH_PROFILES
+from hermes_cli.utils import MB
+from hermes_cli.utils.cache import LastGoodCache
+
+
+READ_SIZE = 256 * 1024
+
+DEFAULT_SIZE_MB = 16
+
+COMMAND_RUNS = 5
+
+# Random data stands in for archives and image layers, which don't compress,
+# and seq's output for logs and API responses, which do.
+RANDOM_COMMAND = 'head -c {size} /dev/urandom'
+
+TEXT_COMMAND = 'seq 1000000000 | head -c {size}'
+
+UPLOAD_COMMAND = 'cat > /dev/null'
+
+
+def check_status(channel, command):
+    status = channel.recv_exit_status()
+    channel.close()
+    if status:
+        raise click.ClickException(
+            "{} exited with status {}".format(command, status),
+        )
+
+
+def download(manager, command):
+    channel = manager.ssh_client.get_transport().open_session()
+    channel.exec_command(command)
+    received = 0
+    while True:
+        data = channel.recv(READ_SIZE)
+        if not data:
+            break
+        received += len(data)
+    check_status(channel, command)
+    return received
+
+
+def upload(manager, data):
+    channel = manager.ssh_client.get_transport().open_session()
+    channel.exec_command(UPLOAD_COMMAND)
+    channel.sendall(data)
+    channel.shutdown_write()
+    check_status(channel, UPLOAD_COMMAND)
+    return len(data)
+
+
+def timed(function, *args):
+    started = time.time()
+    size = function(*args)
+    return size, time.time() - started
+
+
+def bench_profile(instance, profile, size):
+    """
+    Returns the time to connect with profile, the median time to run a
+    command, the total time taken by the transfers, and their MB/s.
+    """
+
+    manager = Manager(instance)
+    manager.ssh_profile = profile
+    _, connect_time = timed(manager.connect_ssh)
+    try:
+        command_time = statistics.median(
+            timed(manager.execute, 'true', False)[1]
+            for _ in range(COMMAND_RUNS)
+        )
+        transfers = [
+            timed(download, manager, RANDOM_COMMAND.format(size=size)),
+            timed(upload, manager, os.urandom(size)),
+            timed(download, manager, TEXT_COMMAND.format(size=size)),
+        ]
+    finally:
+        manager.disconnect_ssh()
+    return {
+        'connect': connect_time,
+        'command': command_time,
+        'transfer': sum(duration for _, duration in transfers),
+        'rates': [
+            transferred / MB / duration for transferred, duration in transfers
+        ],
+    }
+
+
+@cli.command('ssh-bench')
+@click.pass_context
+@click.argument('swarm-name')
+@click.option('--size', '-s', 'size_mb', type=int, default=DEFAULT_SIZE_MB)
+@click.option('--save/--no-save', default=True)
+def ssh_bench(ctx, swarm_name, size_mb, save):
+    managers = list(Manager.list(swarm_name))
+    if not managers:
+        click.echo(
+            "Error: Manager not found for stack \"{}\"".format(swarm_name),
+            err=True,
+        )
+        sys.exit(1)
+    instance = Manager.rank(
+        managers,
+        LastGoodCache().get(swarm_name),
+    )[0].meta
+
+    click.echo(
+        "{:<12} {:>10} {:>10} {:>12} {:>12} {:>12}".format(
+            'profile',
+            'connect ms',
+            'command ms',
+            'random MB/s',
+            'upload MB/s',
+            'text MB/s',
+        )
+    )
+    results = {}
+    for profile in sorted(SSH_PROFILES):
+        results[profile] = result = bench_profile(
+            instance,
+            profile,
+            size_mb * MB,
+        )
+        click.echo(
+            "{:<12} {:>10.1f} {:>10.1f} {:>12.1f} {:>12.1f} {:>12.1f}".format(
+                profile,
+                result['connect'] * 1000,
+                result['command'] * 1000,
+                *result['rates']
+            )
+        )
+
+    # Only bulk transfers go by this. Other commands keep their own profile.
+    best = min(results, key=lambda profile: results[profile]['transfer'])
+    click.echo("Fastest profile for bulk transfers: {}".format(best))
+    if not save:
+        return
+
+    ctx.parent.config['bulk_ssh_profile'] = best
+    os.makedirs(ctx.parent.config_dir, exist_ok=True)
+    with open(ctx.parent.config_file, 'w') as conf_f:
+        yaml.dump(ctx.parent.config, conf_f, default_flow_style=False)
+    click.echo("Saved bulk_ssh_profile: {} to {}".format(
+        best,
+        ctx.parent.config_file,
+    ))
@@ -1,10 +1,619 @@
-import io
-import tarfile
+import contextlib
+import datetime
+import fnmatch
+import functools
+import json
+import os
+import shlex
+import sys
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import botocore.exceptions
 import click
 
 from hermes_cli.manager import Manager
 from hermes_cli.scripts.hermes import cli
+from hermes_cli.ssh_profiles import bulk_ssh_profile
+from hermes_cli.utils import MB, inventory
+from hermes_cli.utils.archive import (
+    empty_tar,
+    is_plain_tar,
+    iter_archive,
+    shard_tar,
+    strip_path,
+    strip_tar,
+)
+from hermes_cli.utils.helper_container import (
+    COMPRESSORS,
+    FILE_LIST_PATH,
+    archive_command,
+    exec_output,
+    exec_stream,
+    fingerprint_command,
+    open_helper,
+    put_file,
+    remove_helper,
+    volume_path,
+)
+from hermes_cli.utils.inventory import s3_config_bucket
+from hermes_cli.utils.journal import CHECKPOINT_SIZE, Journal
+from hermes_cli.utils.manifest import (
+    MANIFEST_SUFFIX,
+    diff_manifests,
+    manifest_command,
+    parse_manifest,
+)
+from hermes_cli.utils.s3_stream import MultipartUpload, parse_s3_url
+from hermes_cli.utils.timings import TIMINGS
+
+
+DEFAULT_JOBS = 4
+
+# docker-py keeps at most 10 connections per client, so more concurrent
+# put_archive calls than that would open connections only to discard them.
+MAX_SHARDS = 10
+
+
+def bulk_manager(swarm_name):
+    return Manager.find(
+        swarm_name,
+        ssh_profile=bulk_ssh_profile(Manager.config),
+    )
+
+
+def volume_s3_path(swarm_name, volume_name, backup_name=''):
+    return inventory.s3_path(
+        'volumes',
+        swarm_name,
+        '{}/{}'.format(volume_name, backup_name),
+    )
+
+
+def check_output_path(path):
+    # Checked up front, as the file is only opened once the helper has
+    # fingerprinted the volume and the journal has been started.
+    if os.path.isdir(path):
+        raise click.BadParameter("{}: Is a directory".format(path))
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        raise click.BadParameter(
+            "{}: No such file or directory".format(directory),
+        )
+    if not os.access(directory, os.W_OK):
+        raise click.BadParameter("{}: Permission denied".format(directory))
+
+
+def output_location(ctx, swarm_name, volume_name, output, suffix='.tar'):
+    s3_url = parse_s3_url(output)
+    if not s3_url:
+        if output != '-':
+            check_output_path(output)
+        return output
+
+    bucket, key = s3_url
+    if not bucket:
+        bucket = s3_config_bucket(ctx)
+    if not key:
+        key = volume_s3_path(
+            swarm_name,
+            volume_name,
+            '{:%Y%m%dT%H%M%SZ}{}'.format(
+                datetime.datetime.utcnow(),
+                suffix,
+            ),
+        )
+    return 's3://{}/{}'.format(bucket, key)
+
+
+def batch_output_location(ctx, swarm_name, volume_name, output, suffix):
+    s3_url = parse_s3_url(output)
+    if not s3_url:
+        return os.path.join(output, volume_name + suffix)
+
+    bucket, prefix = s3_url
+    if not prefix:
+        return output_location(ctx, swarm_name, volume_name, output, suffix)
+    return 's3://{}/{}/{}{}'.format(
+        bucket or s3_config_bucket(ctx),
+        prefix.rstrip('/'),
+        volume_name,
+        suffix,
+    )
+
+
+def list_volumes(manager, driver, patterns=()):
+    volume_names = sorted(
+        docker_volume.name
+        for docker_volume in manager.docker.volumes.list(
+            filters={'driver': driver},
+        )
+    )
+    if not patterns:
+        return volume_names
+    return [
+        volume_name for volume_name in volume_names
+        if any(fnmatch.fnmatch(volume_name, pattern) for pattern in patterns)
+    ]
+
+
+def echo_summary(volume_names, results, duration):
+    """
+    Prints the size, duration and throughput of each volume in results, a
+    dict of volume name to (size, duration), and the totals.
+    """
+
+    row = '{:<{width}}  {:>10}  {:>8}  {:>8}'
+    width = max(len(name) for name in list(volume_names) + ['VOLUME'])
+
+    def echo_row(name, size, seconds):
+        click.echo(row.format(
+            name,
+            '{:.1f}'.format(size / MB),
+            '{:.1f}'.format(seconds),
+            '{:.1f}'.format(size / MB / max(seconds, 0.001)),
+            width=width,
+        ))
+
+    click.echo(row.format(
+        'VOLUME',
+        'SIZE (MB)',
+        'SECONDS',
+        'MB/S',
+        width=width,
+    ))
+    for volume_name in volume_names:
+        if volume_name in results:
+            echo_row(volume_name, *results[volume_name])
+        else:
+            click.echo(row.format(volume_name, 'failed', '', '', width=width))
+    echo_row(
+        'TOTAL',
+        sum(size for size, _ in results.values()),
+        duration,
+    )
+
+
+def put_archives(helper, path, archives, on_done=None):
+    """
+    Uploads archives, a dict of iterators over tar archives, to path in the
+    helper container with one put_archive call each, all at the same time.
+    Calls on_done with the key of each archive once it's been uploaded, and
+    returns the total number of bytes uploaded.
+    """
+
+    if not archives:
+        return 0
+
+    def put(item):
+        key, archive = item
+        sent = [0]
+
+        def counted():
+            for chunk in archive:
+                sent[0] += len(chunk)
+                yield chunk
+
+        helper.put_archive(path, counted())
+        if on_done:
+            on_done(key)
+        return sent[0]
+
+    with ThreadPoolExecutor(max_workers=len(archives)) as executor:
+        return sum(executor.map(put, archives.items()))
+
+
+def input_identity(location):
+    if parse_s3_url(location):
+        return location
+    return '{}:{}:{}'.format(
+        os.path.abspath(location),
+        os.path.getsize(location),
+        os.path.getmtime(location),
+    )
+
+
+def restore_input(
+    helper,
+    volume_name,
+    location,
+    strip,
+    shards,
+    applied,
+    on_done,
+):
+    """
+    Restores the backup at location into the volume, skipping the shards
+    listed in applied, and calling on_done with each shard restored.
+    """
+
+    sharded = shards > 1 and is_plain_tar(location)
+    if shards > 1 and not sharded:
+        click.echo(
+            "Warning: Only uncompressed local archives can be sharded, "
+            "restoring {} as one stream".format(location),
+            err=True,
+        )
+
+    started = time.time()
+    with contextlib.ExitStack() as inputs:
+        if sharded:
+            archives = dict(enumerate(shard_tar(location, shards, strip)))
+        elif 0 in applied:
+            archives = {}
+        else:
+            input_file = inputs.enter_context(open_input(location))
+            archives = {0: strip_tar(input_file, strip)}
+        for shard in applied:
+            archives.pop(shard, None)
+        if applied:
+            click.echo(
+                "Skipping {} already restored shards of {}".format(
+                    len(applied),
+                    location,
+                ),
+                err=True,
+            )
+        with TIMINGS.span(
+            'volume.restore',
+            volume=volume_name,
+            streams=len(archives),
+        ) as span:
+            size = put_archives(
+                helper,
+                '{}/'.format(volume_path(volume_name)),
+                archives,
+                on_done,
+            )
+            span.set(bytes=size)
+
+    duration = max(time.time() - started, 0.001)
+    click.echo(
+        "Restored {:.1f} MB from {} in {:.1f}s ({:.1f} MB/s over "
+        "{} streams)".format(
+            size / MB,
+            location,
+            duration,
+            size / MB / duration,
+            len(archives),
+        ),
+        err=True,
+    )
+
+
+def latest_backup(bucket, prefix):
+    latest = None
+    paginator = inventory.s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for s3_obj in page.get('Contents', []):
+            if s3_obj['Key'].endswith(MANIFEST_SUFFIX):
+                continue
+            if not latest or s3_obj['LastModified'] > latest['LastModified']:
+                latest = s3_obj
+    if not latest:
+        click.echo(
+            "Error: No backups found in s3://{}/{}".format(bucket, prefix),
+            err=True,
+        )
+        sys.exit(1)
+    return latest['Key']
+
+
+def input_location(ctx, swarm_name, volume_name, input_path):
+    s3_url = parse_s3_url(input_path)
+    if not s3_url:
+        # Checked up front, as the file is only opened once the helper is
+        # running, and journals need its size.
+        if input_path != '-' and not os.path.exists(input_path):
+            raise click.BadParameter(
+                "{}: No such file or directory".format(input_path),
+            )
+        return input_path
+
+    bucket, key = s3_url
+    if not bucket:
+        bucket = s3_config_bucket(ctx)
+    if not key:
+        key = latest_backup(bucket, volume_s3_path(swarm_name, volume_name))
+    return 's3://{}/{}'.format(bucket, key)
+
+
+def open_output(location, checkpoint=None, abort_on_error=True):
+    """
+    Opens location for writing. If checkpoint is given, it carries on writing
+    from checkpoint's offset.
+    """
+
+    checkpoint = checkpoint or {}
+    s3_url = parse_s3_url(location)
+    if not s3_url:
+        if not checkpoint.get('offset'):
+            return click.open_file(location, 'wb')
+        output_file = open(location, 'r+b')
+        output_file.truncate(checkpoint['offset'])
+        output_file.seek(checkpoint['offset'])
+        return output_file
+
+    click.echo("Uploading to {}".format(location), err=True)
+    return MultipartUpload(
+        inventory.s3_client(),
+        *s3_url,
+        upload_id=checkpoint.get('upload_id'),
+        parts=checkpoint.get('parts', ()),
+        abort_on_error=abort_on_error,
+    )
+
+
+def output_checkpoint(output_file, wait_for_parts=False):
+    if isinstance(output_file, MultipartUpload):
+        return output_file.checkpoint(wait_for_parts)
+    output_file.flush()
+    os.fsync(output_file.fileno())
+    return {'offset': output_file.tell()}
+
+
+def can_resume(location, checkpoint):
+    if not checkpoint.get('offset'):
+        return False
+
+    s3_url = parse_s3_url(location)
+    if not s3_url:
+        return (
+            os.path.exists(location)
+            and os.path.getsize(location) >= checkpoint['offset']
+        )
+
+    bucket, key = s3_url
+    try:
+        inventory.s3_client().list_parts(
+            Bucket=bucket,
+            Key=key,
+            UploadId=checkpoint['upload_id'],
+            MaxParts=1,
+        )
+    except botocore.exceptions.ClientError:
+        return False
+    return True
+
+
+def discard_checkpoint(location, checkpoint):
+    s3_url = parse_s3_url(location)
+    if not s3_url or not checkpoint.get('upload_id'):
+        return
+
+    bucket, key = s3_url
+    try:
+        inventory.s3_client().abort_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=checkpoint['upload_id'],
+        )
+    except botocore.exceptions.ClientError:
+        pass
+
+
+def backup_journal(swarm_name, volume_name, output, *options):
+    return Journal(
+        ('backup', swarm_name, volume_name, output)
+        + tuple(str(option or '') for option in options)
+    )
+
+
+def discard_journal(journal):
+    """
+    Aborts the S3 upload an interrupted backup left open, if any, and removes
+    its journal.
+    """
+
+    state = journal.load()
+    if state.get('location'):
+        discard_checkpoint(state['location'], state.get('checkpoint') or {})
+    journal.remove()
+
+
+def open_input(location):
+    s3_url = parse_s3_url(location)
+    if not s3_url:
+        return click.open_file(location, 'rb')
+
+    bucket, key = s3_url
+    click.echo("Downloading {}".format(location), err=True)
+    return contextlib.closing(
+        inventory.s3_client().get_object(Bucket=bucket, Key=key)['Body']
+    )
+
+
+def read_manifest(location):
+    if location == '-':
+        return None
+
+    manifest_location = location + MANIFEST_SUFFIX
+    s3_url = parse_s3_url(manifest_location)
+    if not s3_url:
+        if not os.path.exists(manifest_location):
+            return None
+        with open(manifest_location) as manifest_f:
+            return json.load(manifest_f)
+
+    bucket, key = s3_url
+    try:
+        response = inventory.s3_client().get_object(
+            Bucket=bucket,
+            Key=key,
+        )
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+    return json.loads(response['Body'].read().decode('utf-8'))
+
+
+def write_manifest(location, manifest):
+    manifest_location = location + MANIFEST_SUFFIX
+    manifest_data = json.dumps(manifest).encode('utf-8')
+    s3_url = parse_s3_url(manifest_location)
+    if not s3_url:
+        with open(manifest_location, 'wb') as manifest_f:
+            manifest_f.write(manifest_data)
+        return
+
+    bucket, key = s3_url
+    inventory.s3_client().put_object(
+        Bucket=bucket,
+        Key=key,
+        ACL='private',
+        ServerSideEncryption='aws:kms',
+        Body=manifest_data,
+    )
+
+
+def backup_volume(
+    manager,
+    volume_name,
+    location,
+    driver,
+    compress=None,
+    level=None,
+    write_manifest_file=False,
+    since=None,
+    previous_files=None,
+    journal=None,
+):
+    """
+    Backs up volume_name to location. Returns the number of bytes written,
+    and the changed and deleted file lists if a manifest was written.
+
+    If journal is given, progress is checkpointed to it as the backup is
+    written, and a backup it records as interrupted is carried on from the
+    last checkpoint, at its original location, if the volume hasn't changed
+    since.
+    """
+
+    state = journal.load() if journal else {}
+    if state.get('helper'):
+        remove_helper(manager, state['helper'])
+
+    size = 0
+    changed = deleted = None
+    with open_helper(
+        manager,
+        volume_name,
+        driver,
+        keepalive=bool(journal or compress or write_manifest_file),
+    ) as backup_container:
+        checkpoint = {}
+        if journal:
+            with TIMINGS.span('volume.fingerprint', volume=volume_name):
+                fingerprint = exec_output(
+                    manager,
+                    backup_container,
+                    fingerprint_command(volume_name),
+                ).split()[0].decode('ascii')
+            checkpoint = state.get('checkpoint') or {}
+            previous_location = state.get('location')
+            if (
+                previous_location
+                and state.get('fingerprint') == fingerprint
+                and can_resume(previous_location, checkpoint)
+            ):
+                location = previous_location
+                click.echo(
+                    "Resuming {} from {:.1f} MB".format(
+                        location,
+                        checkpoint['offset'] / MB,
+                    ),
+                    err=True,
+                )
+            else:
+                if previous_location:
+                    discard_checkpoint(previous_location, checkpoint)
+                checkpoint = {}
+            state = {
+                'location': location,
+                'fingerprint': fingerprint,
+                'helper': backup_container.id,
+                'checkpoint': checkpoint,
+            }
+            journal.save(state)
+        offset = checkpoint.get('offset', 0)
+
+        if write_manifest_file:
+            with TIMINGS.span('volume.manifest', volume=volume_name):
+                files = parse_manifest(exec_output(
+                    manager,
+                    backup_container,
+                    manifest_command(volume_name),
+                ))
+            changed, deleted = diff_manifests(previous_files or {}, files)
+            manifest = {
+                'volume': volume_name,
+                'base': since,
+                'files': files,
+                'changed': len(changed),
+                'deleted': deleted,
+            }
+
+        if since and not changed:
+            backup_data = [empty_tar()[offset:]]
+        elif since:
+            put_file(
+                backup_container,
+                FILE_LIST_PATH,
+                '\n'.join(changed).encode('utf-8') + b'\n',
+            )
+            backup_data = exec_stream(
+                manager,
+                backup_container,
+                archive_command(
+                    volume_name,
+                    compress,
+                    level,
+                    file_list=FILE_LIST_PATH,
+                    offset=offset,
+                ),
+            )
+        elif compress or journal:
+            backup_data = exec_stream(
+                manager,
+                backup_container,
+                archive_command(volume_name, compress, level, offset=offset),
+            )
+        else:
+            backup_data, source_stat = backup_container.get_archive(
+                '{}/'.format(volume_path(volume_name)),
+            )
+            backup_data = iter_archive(backup_data)
+
+        span = TIMINGS.span('volume.backup', volume=volume_name)
+        with span, open_output(
+            location,
+            checkpoint,
+            abort_on_error=not journal,
+        ) as output_file:
+            checkpointed = 0
+            try:
+                for chunk in backup_data:
+                    output_file.write(chunk)
+                    size += len(chunk)
+                    if journal and size - checkpointed >= CHECKPOINT_SIZE:
+                        checkpointed = size
+                        state['checkpoint'] = output_checkpoint(output_file)
+                        journal.save(state)
+            except BaseException:
+                if journal:
+                    state['checkpoint'] = output_checkpoint(output_file, True)
+                    journal.save(state)
+                raise
+            finally:
+                span.set(bytes=size)
+
+    if write_manifest_file:
+        write_manifest(location, manifest)
+    if journal:
+        journal.remove()
+    return size, changed, deleted
 
 
 @cli.group()
@@ -16,63 +625,300 @@ def volume():
 @click.pass_context
 @click.argument('swarm-name')
 @click.argument('volume-name')
-@click.argument('output-file', type=click.File('wb'))
+@click.argument('output-file')
 @click.option('--driver', '-d', type=str, default='cloudstor:aws')
-def backup(ctx, swarm_name, volume_name, output_file, driver):
-    with Manager.find(swarm_name) as manager:
-        backup_container = manager.docker.containers.create(
-            image='alpine',
-            volume_driver=driver,
-            volumes={
-                volume_name: {
-                    'bind': '/mnt/{}'.format(volume_name),
-                    'mode': 'ro',
-                },
-            },
+@click.option('--compress', '-z', type=click.Choice(sorted(COMPRESSORS)))
+@click.option('--level', '-l', type=int)
+@click.option('--manifest', '-m', 'write_manifest_file', is_flag=True)
+@click.option('--since', '-i', 'since')
+@click.option('--resume/--no-resume', default=True)
+def backup(
+    ctx,
+    swarm_name,
+    volume_name,
+    output_file,
+    driver,
+    compress,
+    level,
+    write_manifest_file,
+    since,
+    resume,
+):
+    suffix = '.tar'
+    if compress:
+        suffix += COMPRESSORS[compress]['suffix']
+    location = output_location(
+        ctx,
+        swarm_name,
+        volume_name,
+        output_file,
+        suffix,
+    )
+    journal = None
+    if output_file != '-':
+        journal = backup_journal(
+            swarm_name,
+            volume_name,
+            output_file,
+            driver,
+            compress,
+            level,
+            write_manifest_file,
+            since,
         )
-        backup_data, source_stat = backup_container.get_archive(
-            '/mnt/{}/'.format(volume_name),
+        if not resume:
+            discard_journal(journal)
+            journal = None
+
+    write_manifest_file = write_manifest_file or bool(since)
+    if write_manifest_file and location == '-':
+        click.echo(
+            "Error: Can't write a manifest when backing up to stdout",
+            err=True,
         )
-        for chunk in backup_data.read_chunked():
-            output_file.write(chunk)
-        backup_container.remove(force=True)
+        sys.exit(1)
+
+    previous_files = {}
+    if since:
+        since = input_location(ctx, swarm_name, volume_name, since)
+        previous_manifest = read_manifest(since)
+        if not previous_manifest:
+            click.echo(
+                "Error: No manifest found for {}".format(since),
+                err=True,
+            )
+            sys.exit(1)
+        previous_files = previous_manifest['files']
+
+    with bulk_manager(swarm_name) as manager:
+        size, changed, deleted = backup_volume(
+            manager,
+            volume_name,
+            location,
+            driver,
+            compress,
+            level,
+            write_manifest_file,
+            since,
+            previous_files,
+            journal,
+        )
+
+    if since:
+        click.echo(
+            "{} changed, {} deleted since {}".format(
+                len(changed),
+                len(deleted),
+                since,
+            ),
+            err=True,
+        )
+
+
+@volume.command('backup-all')
+@click.pass_context
+@click.argument('swarm-name')
+@click.argument('output-dir')
+@click.argument('volume-names', nargs=-1)
+@click.option('--driver', '-d', type=str, default='cloudstor:aws')
+@click.option('--compress', '-z', type=click.Choice(sorted(COMPRESSORS)))
+@click.option('--level', '-l', type=int)
+@click.option('--manifest', '-m', 'write_manifest_file', is_flag=True)
+@click.option(
+    '--jobs',
+    '-j',
+    type=click.IntRange(min=1),
+    default=DEFAULT_JOBS,
+)
+@click.option('--resume/--no-resume', default=True)
+def backup_all(
+    ctx,
+    swarm_name,
+    output_dir,
+    volume_names,
+    driver,
+    compress,
+    level,
+    write_manifest_file,
+    jobs,
+    resume,
+):
+    suffix = '.tar'
+    if compress:
+        suffix += COMPRESSORS[compress]['suffix']
+    if not parse_s3_url(output_dir):
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+        except OSError as e:
+            raise click.BadParameter(
+                "{}: {}".format(output_dir, e.strerror),
+            )
+        if not os.access(output_dir, os.W_OK):
+            raise click.BadParameter(
+                "{}: Permission denied".format(output_dir),
+            )
+
+    results = {}
+    failed = []
+    started = time.time()
+    with bulk_manager(swarm_name) as manager:
+        volume_names = list_volumes(manager, driver, volume_names)
+        if not volume_names:
+            click.echo("Error: No volumes found", err=True)
+            sys.exit(1)
+
+        def backup_one(volume_name):
+            volume_started = time.time()
+            journal = backup_journal(
+                swarm_name,
+                volume_name,
+                output_dir,
+                driver,
+                compress,
+                level,
+                write_manifest_file,
+            )
+            if not resume:
+                discard_journal(journal)
+                journal = None
+            location = batch_output_location(
+                ctx,
+                swarm_name,
+                volume_name,
+                output_dir,
+                suffix,
+            )
+            size, _, _ = backup_volume(
+                manager,
+                volume_name,
+                location,
+                driver,
+                compress,
+                level,
+                write_manifest_file,
+                journal=journal,
+            )
+            return size, time.time() - volume_started
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(backup_one, volume_name): volume_name
+                for volume_name in volume_names
+            }
+            for future in as_completed(futures):
+                volume_name = futures[future]
+                try:
+                    results[volume_name] = future.result()
+                except Exception as e:
+                    click.echo(
+                        "Error: Couldn't back up {}: {}".format(
+                            volume_name,
+                            e,
+                        ),
+                        err=True,
+                    )
+                    failed.append(volume_name)
+
+    echo_summary(volume_names, results, time.time() - started)
+    if failed:
+        sys.exit(1)
 
 
 @volume.command()
 @click.pass_context
 @click.argument('swarm-name')
 @click.argument('volume-name')
-@click.argument('input-file', type=click.File('rb'))
+@click.argument('input-files', nargs=-1, required=True)
 @click.option('--driver', '-d', type=str, default='cloudstor:aws')
 @click.option('--strip', '-s', type=int, default=1)
-def restore(ctx, swarm_name, volume_name, input_file, driver, strip):
-    input_tar = tarfile.open(fileobj=input_file)
-    output_file = io.BytesIO()
-    output_tar = tarfile.open(fileobj=output_file, mode='w')
-
-    for member in input_tar.getmembers():
-        member_name = "/".join(member.name.split('/')[strip:])
-        if member_name:
-            member_f = input_tar.extractfile(member)
-            member.name = member_name
-            output_tar.addfile(member, member_f)
-
-    output_tar.close()
-    output_file.seek(0)
-
-    with Manager.find(swarm_name) as manager:
-        backup_container = manager.docker.containers.create(
-            image='alpine',
-            volume_driver=driver,
-            volumes={
-                volume_name: {
-                    'bind': '/mnt/{}'.format(volume_name),
-                    'mode': 'rw',
-                },
-            },
-        )
-        backup_container.put_archive(
-            '/mnt/{}/'.format(volume_name),
-            output_file.read()
+@click.option('--shards', '-n', type=click.IntRange(1, MAX_SHARDS), default=1)
+def restore(ctx, swarm_name, volume_name, input_files, driver, strip, shards):
+    locations = [
+        input_location(ctx, swarm_name, volume_name, input_file)
+        for input_file in input_files
+    ]
+    deletions = []
+    for previous_location, location in zip([None] + locations, locations):
+        manifest = read_manifest(location) or {}
+        if manifest.get('base') and manifest['base'] != previous_location:
+            click.echo(
+                "Warning: {} is an increment of {}, not {}".format(
+                    location,
+                    manifest['base'],
+                    previous_location,
+                ),
+                err=True,
+            )
+        deletions.append([
+            strip_path(path, strip)
+            for path in manifest.get('deleted', [])
+        ])
+
+    journal = None
+    if '-' not in locations:
+        journal = Journal(
+            ('restore', swarm_name, volume_name, driver)
+            + (str(strip), str(shards))
+            + tuple(input_identity(location) for location in locations)
         )
-        backup_container.remove(force=True)
+    state = journal.load() if journal else {}
+    applied = state.setdefault('applied', {})
+    journal_lock = threading.Lock()
+
+    def mark_applied(location, shard=None):
+        with journal_lock:
+            if shard is None:
+                applied[location] = True
+            else:
+                applied.setdefault(location, []).append(shard)
+            if journal:
+                journal.save(state)
+
+    with bulk_manager(swarm_name) as manager:
+        if state.get('helper'):
+            remove_helper(manager, state['helper'])
+        with open_helper(
+            manager,
+            volume_name,
+            driver,
+            mode='rw',
+            keepalive=any(deletions),
+        ) as backup_container:
+            if journal:
+                state['helper'] = backup_container.id
+                journal.save(state)
+            for location, deleted in zip(locations, deletions):
+                if applied.get(location) is True:
+                    click.echo(
+                        "Skipping {}, already restored".format(location),
+                        err=True,
+                    )
+                    continue
+                restore_input(
+                    backup_container,
+                    volume_name,
+                    location,
+                    strip,
+                    shards,
+                    applied.get(location, []),
+                    functools.partial(mark_applied, location),
+                )
+                if deleted:
+                    put_file(
+                        backup_container,
+                        FILE_LIST_PATH,
+                        '\n'.join(deleted).encode('utf-8') + b'\n',
+                    )
+                    exec_output(
+                        manager,
+                        backup_container,
+                        "cd {} && tr '\\n' '\\0' < {} | xargs -0 rm -f --"
+                        .format(
+                            shlex.quote(volume_path(volume_name)),
+                            FILE_LIST_PATH,
+                        ),
+                    )
+                mark_applied(location)
+
+    if journal:
+        journal.remove()
@@ -1,14 +1,103 @@
 import os
+import select
 import socket
 import tempfile
-import threading
+import time
 import sys
 
-import boto3
+from concurrent.futures import ThreadPoolExecutor
+
 import click
-import docker
 
 from paramiko.client import SSHClient, MissingHostKeyPolicy
+from paramiko.ssh_exception import ChannelException, SSHException
+
+from hermes_cli.ssh_profiles import (
+    DEFAULT_SSH_PROFILE,
+    SSH_PROFILES,
+    transport_factory,
+)
+from hermes_cli.tunnel import (
+    DEFAULT_BUFFER_SIZE,
+    DEFAULT_POOL_SIZE,
+    ChannelPool,
+    Tunnel,
+    open_streamlocal_channel,
+)
+from hermes_cli.utils import HELPER_IMAGE, MANAGER_CONFIG
+from hermes_cli.utils.agent import AgentError, agent_request
+from hermes_cli.utils.cache import (
+    DEFAULT_MANAGER_CACHE_TTL,
+    BootstrapCache,
+    LastGoodCache,
+    ManagerCache,
+)
+from hermes_cli.utils.timings import TIMINGS
+
+
+DOCKER_SOCKET_PATH = '/var/run/docker.sock'
+
+DOCKER_SOCKET_PATHS = (DOCKER_SOCKET_PATH, '/run/docker.sock')
+
+# Bumped whenever BOOTSTRAP_COMMAND's output changes, so that older cached
+# results are ignored.
+BOOTSTRAP_VERSION = '1'
+
+# Prints what Manager.bootstrap needs to know as key=value lines.
+BOOTSTRAP_COMMAND = '; '.join((
+    'echo bootstrap={version}',
+    'command -v socat >/dev/null && echo socat=1',
+    'for path in {socket_paths}; do '
+    'if test -S $path; then echo docker_socket=$path; break; fi; done',
+    "docker version --format 'docker_api_version={{{{.Server.APIVersion}}}}'"
+    ' 2>/dev/null',
+    'for image in {images}; do '
+    'docker image inspect $image >/dev/null 2>&1 && echo image=$image; done',
+    'true',
+)).format(
+    version=BOOTSTRAP_VERSION,
+    socket_paths=' '.join(DOCKER_SOCKET_PATHS),
+    images=HELPER_IMAGE,
+)
+
+SSH_PORT = 22
+
+STDOUT = 'stdout'
+STDERR = 'stderr'
+
+READ_SIZE = 32 * 1024
+
+MAX_LINE_LENGTH = 64 * 1024
+
+STDERR_POLL_INTERVAL = 0.1
+
+PROBE_TIMEOUT = 5
+
+
+def parse_bootstrap(output):
+    """
+    Returns what BOOTSTRAP_COMMAND found from its output. The version is
+    None if the command didn't run.
+    """
+
+    remote = {
+        'version': None,
+        'socat': False,
+        'docker_socket': None,
+        'docker_api_version': None,
+        'images': [],
+    }
+    for line in output.splitlines():
+        key, _, value = line.strip().partition('=')
+        if key == 'bootstrap':
+            remote['version'] = value
+        elif key == 'socat':
+            remote['socat'] = True
+        elif key == 'image':
+            remote['images'].append(value)
+        elif key in remote and value:
+            remote[key] = value
+    return remote
 
 
 class IgnorePolicy(MissingHostKeyPolicy):
@@ -16,12 +105,101 @@ class IgnorePolicy(MissingHostKeyPolicy):
         return
 
 
+class _LineBuffer(object):
+    def __init__(self, max_line_length):
+        self.max_line_length = max_line_length
+        self.pending = b''
+
+    def feed(self, data):
+        lines = (self.pending + data).split(b'\n')
+        self.pending = lines.pop()
+        while len(self.pending) > self.max_line_length:
+            lines.append(self.pending[:self.max_line_length])
+            self.pending = self.pending[self.max_line_length:]
+        return [line + b'\n' for line in lines]
+
+    def flush(self):
+        lines = [self.pending] if self.pending else []
+        self.pending = b''
+        return lines
+
+
+class RemoteCommand(object):
+    """
+    Iterates over (stream, line) pairs from a remote command as its output
+    arrives, where stream is STDOUT or STDERR. Lines longer than
+    max_line_length are split, so memory use is bounded. The exit status is
+    available as status once iteration has finished.
+    """
+
+    def __init__(self, channel, max_line_length=MAX_LINE_LENGTH):
+        self.channel = channel
+        self.max_line_length = max_line_length
+        self.status = None
+
+    def __iter__(self):
+        buffers = {
+            STDOUT: _LineBuffer(self.max_line_length),
+            STDERR: _LineBuffer(self.max_line_length),
+        }
+        readers = (
+            (STDOUT, self.channel.recv_ready, self.channel.recv),
+            (STDERR, self.channel.recv_stderr_ready, self.channel.recv_stderr),
+        )
+
+        while True:
+            # Checked before reading, since output can arrive between the
+            # reads and the check. Once it's set, everything the command
+            # sent is buffered, so the reads below drain it.
+            done = self.channel.eof_received or self.channel.closed
+            received = False
+            for stream, ready, recv in readers:
+                if ready():
+                    received = True
+                    for line in buffers[stream].feed(recv(READ_SIZE)):
+                        yield stream, line.decode('utf-8', 'replace')
+            if received:
+                continue
+            if done:
+                break
+            # The channel's file descriptor only signals stdout, so this also
+            # acts as the polling interval for stderr.
+            select.select([self.channel], [], [], STDERR_POLL_INTERVAL)
+
+        for stream, _, _ in readers:
+            for line in buffers[stream].flush():
+                yield stream, line.decode('utf-8', 'replace')
+
+        self.status = self.channel.recv_exit_status()
+        self.channel.close()
+
+
 class Manager(object):
-    config = {}
+    config = MANAGER_CONFIG
 
     @classmethod
-    def list(cls, cf_stack=None):
+    def list(cls, cf_stack=None, ssh_profile=None):
+        for instance in cls.describe_instances(cf_stack):
+            yield cls(instance, ssh_profile)
+
+    @classmethod
+    def describe_instances(cls, cf_stack=None):
+        cache = ManagerCache(
+            ttl=Manager.config.get(
+                'manager_cache_ttl',
+                DEFAULT_MANAGER_CACHE_TTL,
+            ),
+        )
+        if cf_stack and not Manager.config.get('refresh_managers'):
+            instances = cache.get(cf_stack)
+            if instances:
+                return instances
+
+        # boto3 takes a while to import, and isn't needed if the managers
+        # are cached.
+        import boto3
         ec2 = boto3.client('ec2')
+        TIMINGS.instrument_boto(ec2)
         filters = [
             {
                 'Name': 'tag:swarm-node-type',
@@ -43,23 +221,115 @@ class Manager(object):
                     cf_stack,
                 ]
             })
-        results = ec2.describe_instances(
-            Filters=filters
-        )
-        for reservation in results.get('Reservations', []):
-            for instance in reservation.get('Instances', []):
-                yield cls(instance)
+        instances = []
+        for results in ec2.get_paginator('describe_instances').paginate(
+            Filters=filters,
+        ):
+            for reservation in results.get('Reservations', []):
+                instances.extend(reservation.get('Instances', []))
+
+        if cf_stack and instances:
+            cache.put(cf_stack, instances)
+        return instances
 
     @classmethod
-    def find(cls, stack=None):
-        for manager in cls.list(stack):
+    @TIMINGS.timed('manager.find')
+    def find(cls, stack=None, ssh_profile=None):
+        """
+        Returns a connected manager for stack. ssh_profile is the SSH profile
+        the command wants, unless one was given with --ssh-profile. Managers
+        from the agent keep the agent's connection, whatever its profile.
+        """
+
+        if stack and Manager.config.get('use_agent', True):
+            manager = cls.find_with_agent(stack)
+            if manager:
+                return manager
+
+        managers = list(cls.list(stack, ssh_profile))
+        if not managers:
+            click.echo(
+                "Error: Manager not found for stack \"{}\"".format(stack),
+                err=True,
+            )
+            sys.exit(1)
+
+        last_good = LastGoodCache()
+        for manager in cls.rank(managers, last_good.get(stack)):
+            try:
+                manager.connect_ssh()
+            except (OSError, SSHException) as e:
+                click.echo(
+                    "Warning: Couldn't connect to manager {}: {}".format(
+                        manager.dns_name,
+                        e,
+                    ),
+                    err=True,
+                )
+                continue
+            if stack:
+                last_good.put(stack, manager.meta['InstanceId'])
             return manager
+
         click.echo(
-            "Error: Manager not found for stack \"{}\"".format(stack),
+            "Error: Couldn't connect to any manager for stack \"{}\"".format(
+                stack,
+            ),
             err=True,
         )
         sys.exit(1)
 
+    @classmethod
+    def rank(cls, managers, last_good_id=None):
+        """
+        Orders managers for connection attempts: the last manager we connected
+        to first, then the rest by how quickly they answer with an SSH banner.
+        Managers which don't answer go last.
+        """
+
+        if len(managers) < 2:
+            return managers
+
+        preferred = [
+            manager for manager in managers
+            if manager.meta['InstanceId'] == last_good_id
+        ]
+        others = [
+            manager for manager in managers
+            if manager.meta['InstanceId'] != last_good_id
+        ]
+        if len(others) < 2:
+            return preferred + others
+
+        with ThreadPoolExecutor(max_workers=len(others)) as executor:
+            latencies = list(executor.map(lambda m: m.probe(), others))
+        ranked = sorted(
+            zip(latencies, others),
+            key=lambda ranked_manager: (
+                ranked_manager[0] is None,
+                ranked_manager[0],
+            ),
+        )
+        return preferred + [manager for _, manager in ranked]
+
+    @classmethod
+    def find_with_agent(cls, stack):
+        try:
+            response = agent_request('tunnel', swarm_name=stack)
+        except AgentError as e:
+            click.echo(
+                "Error: hermes agent: {}".format(e),
+                err=True,
+            )
+            sys.exit(1)
+        if not response:
+            return None
+
+        manager = cls(response['instance'])
+        manager.socket_path = response['socket_path']
+        manager._agent_tunnel = True
+        return manager
+
     @classmethod
     def configure(cls, config):
         Manager.config.update(config)
@@ -67,6 +337,7 @@ class Manager(object):
     def __init__(
         self,
         instance,
+        ssh_profile=None,
     ):
         self.meta = instance
         self.stack = None
@@ -75,10 +346,20 @@ class Manager(object):
                 self.stack = tag['Value']
                 break
         self.dns_name = instance['PublicDnsName']
+        self.ssh_profile = (
+            Manager.config.get('ssh_profile')
+            or ssh_profile
+            or DEFAULT_SSH_PROFILE
+        )
         self.docker_client = None
         self.ssh_client = None
-        self._socat_installed = False
+        self.remote = None
+        self._streamlocal = Manager.config.get(
+            'docker_forwarding',
+            'auto',
+        ) != 'socat'
         self._docker_listening = False
+        self._agent_tunnel = False
 
     def __str__(self):
         return "{} {} {}".format(
@@ -94,108 +375,187 @@ class Manager(object):
     def __exit__(self, exc_type, exc_value, traceback):
         self.close_docker_socket()
 
+    @TIMINGS.timed('ssh.probe')
+    def probe(self, timeout=PROBE_TIMEOUT):
+        start = time.time()
+        try:
+            with socket.create_connection(
+                (self.dns_name, Manager.config.get('ssh_port', SSH_PORT)),
+                timeout=timeout,
+            ) as sock:
+                if not sock.recv(256).startswith(b'SSH-'):
+                    return None
+        except OSError:
+            return None
+        return time.time() - start
+
     def connect_ssh(self, username='docker'):
         key_filename = Manager.config.get('ssh_key_filename', None)
-        if key_filename is 'autodetect':
+        if key_filename == 'autodetect':
             key_filename = None
+        profile = SSH_PROFILES[self.ssh_profile]
 
         self.ssh_client = SSHClient()
         self.ssh_client.set_missing_host_key_policy(IgnorePolicy())
-        self.ssh_client.connect(
-            self.dns_name,
-            username=username,
-            key_filename=key_filename,
-            compress=True,
-        )
+        try:
+            with TIMINGS.span(
+                'ssh.connect',
+                host=self.dns_name,
+                profile=self.ssh_profile,
+            ):
+                self.ssh_client.connect(
+                    self.dns_name,
+                    port=Manager.config.get('ssh_port', SSH_PORT),
+                    username=username,
+                    key_filename=key_filename,
+                    timeout=PROBE_TIMEOUT,
+                    banner_timeout=PROBE_TIMEOUT,
+                    compress=profile['compress'],
+                    transport_factory=transport_factory(profile),
+                )
+        except (OSError, SSHException):
+            # The cached address may be for a manager that's been replaced.
+            if self.stack:
+                ManagerCache().invalidate(self.stack)
+            raise
 
     def disconnect_ssh(self):
         self.ssh_client.close()
 
-    def execute(self, command, echo=True, echo_stdout=None, echo_stderr=None):
+    def execute(
+        self,
+        command,
+        echo=True,
+        echo_stdout=None,
+        echo_stderr=None,
+        callback=None,
+    ):
         if echo_stdout is None:
             echo_stdout = echo
         if echo_stderr is None:
             echo_stderr = echo
 
-        if not self.ssh_client:
-            self.connect_ssh()
-
         if echo:
             click.echo("{}@{} $ \033[1m{}\033[0m".format(
                 self.meta['InstanceId'],
                 self.stack,
                 command,
             ))
-        channel = self.ssh_client.get_transport().open_session()
-        stdout = channel.makefile()
-        stderr = channel.makefile_stderr()
-        channel.exec_command(command)
-        status = channel.recv_exit_status()
 
-        if echo_stdout:
-            for line in stdout.readlines():
-                click.echo("\t\033[92m+ {}\033[0m".format(str(line).strip()))
-        if echo_stderr:
-            for line in stderr.readlines():
-                click.echo(
-                    "\t\033[91m- {}\033[0m".format(str(line).strip()),
-                    err=True,
-                )
+        with TIMINGS.span('ssh.execute', command=command):
+            remote_command = self.run(command)
+            for stream, line in remote_command:
+                if stream == STDOUT and echo_stdout:
+                    click.echo("\t\033[92m+ {}\033[0m".format(line.strip()))
+                elif stream == STDERR and echo_stderr:
+                    click.echo(
+                        "\t\033[91m- {}\033[0m".format(line.strip()),
+                        err=True,
+                    )
+                if callback:
+                    callback(stream, line)
 
-        return status
+        return remote_command.status
 
-    def install_socat(self):
-        if self.execute("socat -V", echo=False) > 0:
-            self.execute("sudo apk add --no-cache socat")
-        self._socat_installed = True
+    def run(self, command):
+        if not self.ssh_client:
+            self.connect_ssh()
 
-    def open_docker_socket(self):
-        def _recv_send(
-            side_a,
-            side_b,
-            cleanup_event,
+        channel = self.ssh_client.get_transport().open_session()
+        channel.exec_command(command)
+        return RemoteCommand(channel)
+
+    @TIMINGS.timed('manager.bootstrap')
+    def bootstrap(self):
+        """
+        Finds out, in one command, whether socat is installed on the manager,
+        where its Docker socket is, its Docker API version and which helper
+        images it has. The result is cached for the life of the instance,
+        unless managers are being refreshed.
+        """
+
+        if self.remote is not None:
+            return self.remote
+
+        if not Manager.config.get('refresh_managers'):
+            self.remote = self.cached_remote()
+            if self.remote is not None:
+                return self.remote
+
+        remote_command = self.run(BOOTSTRAP_COMMAND)
+        self.remote = parse_bootstrap(''.join(
+            line for stream, line in remote_command if stream == STDOUT
+        ))
+        self.save_remote()
+        return self.remote
+
+    def cached_remote(self):
+        remote = BootstrapCache().get(self.meta)
+        if remote and remote['version'] == BOOTSTRAP_VERSION:
+            return remote
+        return None
+
+    def save_remote(self):
+        # Results from a command that didn't run aren't worth keeping, but
+        # hermes can carry on with the defaults.
+        if self.remote['version'] == BOOTSTRAP_VERSION:
+            BootstrapCache().put(self.meta, self.remote)
+
+    def install_socat(self):
+        if self.bootstrap()['socat']:
+            return
+        # A failed install isn't recorded, so it's tried again next time.
+        if self.execute("sudo apk add --no-cache socat") == 0:
+            self.remote['socat'] = True
+            self.save_remote()
+
+    def ensure_image(self, image):
+        """
+        Pulls image if the bootstrap asked Docker for it and it was missing.
+        """
+
+        if (
+            not (self.remote or {}).get('docker_api_version')
+            or image in self.remote['images']
         ):
-            side_a.settimeout(1)
-            while not cleanup_event.is_set():
-                try:
-                    side_b.send(
-                        side_a.recv(1)
-                    )
-                except socket.timeout:
-                    continue
-                except OSError:
-                    cleanup_event.set()
-                    break
-            side_a.close()
-
-        def _accept_and_forward(listen_sock):
-            while True:
-                cleanup = threading.Event()
-
-                client_connection, _ = listen_sock.accept()
-
-                self.server_transport = self.ssh_client.get_transport()
-                self.server_channel = self.server_transport.open_session()
-                self.server_channel.exec_command(
-                    "socat UNIX-CONNECT:/var/run/docker.sock STDIO"
-                )
+            return
+        self.docker.images.pull(image)
+        self.remote['images'].append(image)
+        self.save_remote()
 
-                send_to_server_thread = threading.Thread(
-                    target=_recv_send,
-                    args=(client_connection, self.server_channel, cleanup),
-                    daemon=True,
+    @property
+    def docker_socket_path(self):
+        return (self.remote or {}).get('docker_socket') or DOCKER_SOCKET_PATH
+
+    @TIMINGS.timed('ssh.open_docker_channel')
+    def open_docker_channel(self):
+        transport = self.ssh_client.get_transport()
+
+        if self._streamlocal:
+            try:
+                return open_streamlocal_channel(
+                    transport,
+                    self.docker_socket_path,
                 )
-                send_to_server_thread.start()
+            except ChannelException:
+                self._streamlocal = False
 
-                send_to_client_thread = threading.Thread(
-                    target=_recv_send,
-                    args=(self.server_channel, client_connection, cleanup),
-                    daemon=True,
-                )
-                send_to_client_thread.start()
+        self.install_socat()
+        channel = transport.open_session()
+        channel.exec_command(
+            "socat UNIX-CONNECT:{} STDIO".format(self.docker_socket_path)
+        )
+        return channel
 
-        if not self._socat_installed:
-            self.install_socat()
+    @TIMINGS.timed('tunnel.open')
+    def open_docker_socket(self):
+        if self._agent_tunnel:
+            self._docker_listening = True
+            return
+
+        if not self.ssh_client:
+            self.connect_ssh()
+        self.bootstrap()
 
         self.socket_prefix = tempfile.mkdtemp()
         self.socket_path = os.path.join(self.socket_prefix, 'docker.sock')
@@ -204,31 +564,58 @@ class Manager(object):
         self.listen_sock.bind(self.socket_path)
         self.listen_sock.listen()
 
-        accept_thread = threading.Thread(
-            target=_accept_and_forward,
-            args=(self.listen_sock,),
-            daemon=True,
+        self.channel_pool = ChannelPool(
+            self.open_docker_channel,
+            size=Manager.config.get('channel_pool_size', DEFAULT_POOL_SIZE),
+        )
+        self.channel_pool.start()
+        self.tunnel = Tunnel(
+            self.listen_sock,
+            self.channel_pool.get,
+            buffer_size=Manager.config.get(
+                'tunnel_buffer_size',
+                DEFAULT_BUFFER_SIZE,
+            ),
         )
-        accept_thread.start()
+        self.tunnel.start()
         self._docker_listening = True
-        os.environ['DOCKER_HOST'] = "unix://{}".format(self.socket_path)
 
     def close_docker_socket(self):
         if not self._docker_listening:
             return
 
         self._docker_listening = False
+        if self._agent_tunnel:
+            return
+
+        self.tunnel.close()
+        self.channel_pool.close()
+        TIMINGS.count('tunnel bytes sent', self.tunnel.bytes_sent)
+        TIMINGS.count('tunnel bytes received', self.tunnel.bytes_received)
+        TIMINGS.count('channel pool hits', self.channel_pool.hits)
+        TIMINGS.count('channel pool misses', self.channel_pool.misses)
         self.listen_sock.close()
         os.unlink(self.socket_path)
         os.rmdir(self.socket_prefix)
 
-        if hasattr(self, 'server_channel'):
-            self.server_channel.close()
-
     def init_docker_client(self):
         if not self._docker_listening:
             self.open_docker_socket()
-        self.docker_client = docker.from_env()
+        if self.remote is None:
+            # Tunnels from the agent are bootstrapped by the agent, which
+            # shares the cache.
+            self.remote = self.cached_remote()
+        import docker
+        # With the API version known, docker-py doesn't need to ask for it.
+        self.docker_client = docker.DockerClient(
+            base_url=self.docker_host,
+            version=(self.remote or {}).get('docker_api_version'),
+        )
+        TIMINGS.instrument_docker(self.docker_client.api)
+
+    @property
+    def docker_host(self):
+        return "unix://{}".format(self.socket_path)
 
     @property
     def docker(self):
@@ -1,15 +1,88 @@
+import importlib
 import os
+import time
 
 import click
 import yaml
 
-from hermes_cli.manager import Manager
+from hermes_cli.ssh_profiles import SSH_PROFILES
+from hermes_cli.utils import CONFIG_DIR, MANAGER_CONFIG
+from hermes_cli.utils.timings import TIMINGS
 
 
-@click.group()
+COMMAND_MODULES = {
+    'agent': 'hermes_cli.commands.agent',
+    'config': 'hermes_cli.commands.config',
+    'configure': 'hermes_cli.commands.configure',
+    'exec': 'hermes_cli.commands.exec_command',
+    'secret': 'hermes_cli.commands.secret',
+    'ssh-bench': 'hermes_cli.commands.ssh_bench',
+    'volume': 'hermes_cli.commands.volume',
+}
+
+
+class LazyGroup(click.Group):
+    """
+    A group which only imports a subcommand's module when that subcommand is
+    used, so commands don't pay for loading boto3, docker and paramiko unless
+    they need them. The modules register their commands on import.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.command_modules = kwargs.pop('command_modules', {})
+        super(LazyGroup, self).__init__(*args, **kwargs)
+
+    def list_commands(self, ctx):
+        return sorted(set(self.commands) | set(self.command_modules))
+
+    def get_command(self, ctx, name):
+        if name not in self.commands and name in self.command_modules:
+            importlib.import_module(self.command_modules[name])
+        return self.commands.get(name)
+
+    def format_commands(self, ctx, formatter):
+        # Listed without importing anything. None of the commands have help
+        # text, so there's nothing to lose.
+        rows = []
+        for name in self.list_commands(ctx):
+            command = self.commands.get(name)
+            short_help = command.get_short_help_str() if command else ''
+            rows.append((name, short_help))
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
+
+
+def report_timings(ctx, summary, trace_file):
+    TIMINGS.add(
+        'hermes {}'.format(ctx.invoked_subcommand),
+        TIMINGS.started,
+        time.time() - TIMINGS.started,
+    )
+    if trace_file:
+        TIMINGS.write_trace(trace_file)
+    if summary:
+        click.echo(TIMINGS.summary(), err=True)
+
+
+@click.group(cls=LazyGroup, command_modules=COMMAND_MODULES)
 @click.pass_context
-def cli(ctx):
-    ctx.config_dir = os.path.expanduser('~/.hermes/')
+@click.option('--refresh', is_flag=True)
+@click.option('--ssh-profile', type=click.Choice(sorted(SSH_PROFILES)))
+@click.option('--timings', is_flag=True, envvar='HERMES_TIMINGS')
+@click.option(
+    '--timings-file',
+    type=click.Path(dir_okay=False, writable=True),
+    envvar='HERMES_TIMINGS_FILE',
+)
+def cli(ctx, refresh, ssh_profile, timings, timings_file):
+    if timings or timings_file:
+        TIMINGS.enable()
+        ctx.call_on_close(
+            lambda: report_timings(ctx, timings, timings_file),
+        )
+
+    ctx.config_dir = CONFIG_DIR
     ctx.config_file = os.path.join(ctx.config_dir, 'config.yml')
     ctx.config = {
         'ssh_key_filename': 'autodetect',
@@ -18,15 +91,21 @@ def cli(ctx):
 
     try:
         with open(ctx.config_file) as conf_f:
-            ctx.config.update(yaml.load(conf_f))
+            ctx.config.update(yaml.safe_load(conf_f) or {})
     except IOError:
         pass
 
-    Manager.configure(ctx.config)
-
-
-from hermes_cli.commands.configure import *
-from hermes_cli.commands.config import *
-from hermes_cli.commands.exec_command import *
-from hermes_cli.commands.secret import *
-from hermes_cli.commands.volume import *
+    MANAGER_CONFIG.update(ctx.config)
+    MANAGER_CONFIG['refresh_managers'] = refresh
+    # Only --ssh-profile overrides the profile each command picks.
+    MANAGER_CONFIG['ssh_profile'] = ssh_profile
+    bulk_ssh_profile = MANAGER_CONFIG.get('bulk_ssh_profile')
+    if bulk_ssh_profile and bulk_ssh_profile not in SSH_PROFILES:
+        raise click.UsageError(
+            "Unknown bulk_ssh_profile \"{}\" in {}, expected one of: "
+            "{}".format(
+                bulk_ssh_profile,
+                ctx.config_file,
+                ', '.join(sorted(SSH_PROFILES)),
+            )
+        )
@@ -0,0 +1,70 @@
+import socket
+
+from hermes_cli.utils import MB
+
+
+# How SSH connections to managers are set up. "interactive" suits Docker API
+# requests and command output, which are small and compress well. "bulk"
+# suits volume archives and image layers, which are large and usually
+# compressed already, so compressing them again only costs CPU.
+SSH_PROFILES = {
+    'interactive': {
+        'compress': True,
+        'ciphers': ('aes128-ctr',),
+        'window_size': 2 * MB,
+        'max_packet_size': 32 * 1024,
+    },
+    'bulk': {
+        'compress': False,
+        'ciphers': ('aes128-gcm@openssh.com', 'aes128-ctr'),
+        'window_size': 16 * MB,
+        'max_packet_size': 32 * 1024,
+    },
+}
+
+DEFAULT_SSH_PROFILE = 'interactive'
+
+BULK_SSH_PROFILE = 'bulk'
+
+
+def bulk_ssh_profile(config):
+    """
+    Returns the profile for bulk transfers: the one hermes ssh-bench found
+    fastest, if it's been run, or else bulk.
+    """
+
+    return config.get('bulk_ssh_profile') or BULK_SSH_PROFILE
+
+
+def transport_factory(profile):
+    """
+    Returns a transport_factory for SSHClient.connect which sets up
+    transports for profile. Its ciphers are preferred to the rest, rather
+    than replacing them, in case the server doesn't support them.
+    """
+
+    def create_transport(sock, **kwargs):
+        # Imported here so the CLI can list profiles without paramiko.
+        from paramiko.transport import Transport
+
+        # Without this, Nagle's algorithm holds back each small request
+        # until the previous one is acknowledged, adding a delayed ACK
+        # (~40 ms) to every channel open and command.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = Transport(
+            sock,
+            default_window_size=profile['window_size'],
+            default_max_packet_size=profile['max_packet_size'],
+            **kwargs
+        )
+        options = transport.get_security_options()
+        preferred = [
+            cipher for cipher in profile['ciphers']
+            if cipher in options.ciphers
+        ]
+        options.ciphers = preferred + [
+            cipher for cipher in options.ciphers if cipher not in preferred
+        ]
+        return transport
+
+    return create_transport
@@ -0,0 +1,451 @@
+import collections
+import selectors
+import socket
+import threading
+import time
+
+from paramiko.channel import Channel
+from paramiko.common import cMSG_CHANNEL_OPEN
+from paramiko.message import Message
+from paramiko.ssh_exception import SSHException
+
+
+DEFAULT_BUFFER_SIZE = 256 * 1024
+
+DEFAULT_POOL_SIZE = 2
+
+STREAMLOCAL_CHANNEL = 'direct-streamlocal@openssh.com'
+
+# How often to retry sends to channels whose SSH window is full. Paramiko
+# doesn't expose write readiness on the channel's file descriptor.
+CHANNEL_RETRY_INTERVAL = 0.05
+
+
+def open_streamlocal_channel(transport, socket_path, timeout=None):
+    """
+    Opens a channel connected to a Unix socket on the server, like
+    Transport.open_channel does for "direct-tcpip". Paramiko doesn't know how
+    to encode the request for this channel type, so it's built here.
+
+    Raises ChannelException if the server refuses the channel.
+    """
+
+    if not transport.active:
+        raise SSHException("SSH session not active")
+    if timeout is None:
+        timeout = transport.channel_timeout
+
+    with transport.lock:
+        window_size = transport._sanitize_window_size(None)
+        max_packet_size = transport._sanitize_packet_size(None)
+        chanid = transport._next_channel()
+        m = Message()
+        m.add_byte(cMSG_CHANNEL_OPEN)
+        m.add_string(STREAMLOCAL_CHANNEL)
+        m.add_int(chanid)
+        m.add_int(window_size)
+        m.add_int(max_packet_size)
+        m.add_string(socket_path)
+        m.add_string('')
+        m.add_int(0)
+        channel = Channel(chanid)
+        transport._channels.put(chanid, channel)
+        transport.channel_events[chanid] = event = threading.Event()
+        transport.channels_seen[chanid] = True
+        channel._set_transport(transport)
+        channel._set_window(window_size, max_packet_size)
+    transport._send_user_message(m)
+
+    deadline = time.time() + timeout
+    while not event.wait(0.1):
+        if not transport.active:
+            break
+        if time.time() > deadline:
+            raise SSHException("Timeout opening channel.")
+
+    channel = transport._channels.get(chanid)
+    if channel is not None:
+        return channel
+    raise transport.get_exception() or SSHException("Unable to open channel.")
+
+
+class ChannelPool(object):
+    """
+    Keeps up to size channels from channel_factory open and ready to use,
+    refilling from a background thread as they're handed out.
+    """
+
+    def __init__(self, channel_factory, size=DEFAULT_POOL_SIZE):
+        self.channel_factory = channel_factory
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._channels = collections.deque()
+        self._lock = threading.Lock()
+        self._refill = threading.Event()
+        self._closing = False
+        self._thread = None
+
+    def __str__(self):
+        return "channel pool: size {} idle {} hits {} misses {}".format(
+            self.size,
+            len(self._channels),
+            self.hits,
+            self.misses,
+        )
+
+    def start(self):
+        if self.size < 1:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._refill.set()
+
+    def close(self):
+        self._closing = True
+        self._refill.set()
+        if self._thread:
+            self._thread.join()
+        with self._lock:
+            while self._channels:
+                self._channels.popleft().close()
+
+    def get(self):
+        with self._lock:
+            while self._channels:
+                channel = self._channels.popleft()
+                if self._usable(channel):
+                    self.hits += 1
+                    self._refill.set()
+                    return channel
+                channel.close()
+            self.misses += 1
+        self._refill.set()
+        return self.channel_factory()
+
+    def _usable(self, channel):
+        return not (
+            channel.closed
+            or channel.eof_received
+            or channel.recv_ready()
+        )
+
+    def _run(self):
+        while True:
+            self._refill.wait()
+            self._refill.clear()
+            while not self._closing and len(self._channels) < self.size:
+                try:
+                    channel = self.channel_factory()
+                except Exception:
+                    # Wait for the next get() before trying again, rather
+                    # than hammering a server that's refusing channels.
+                    break
+                with self._lock:
+                    self._channels.append(channel)
+            if self._closing:
+                return
+
+
+class _Connection(object):
+    def __init__(self, client, channel):
+        self.client = client
+        self.channel = channel
+        self.to_channel = b''
+        self.to_client = b''
+        self.client_eof = False
+        self.channel_eof = False
+        self.channel_shut = False
+        self.client_shut = False
+        self.client_events = 0
+        self.channel_events = 0
+
+    @property
+    def finished(self):
+        return self.channel_shut and self.client_shut
+
+
+class Tunnel(object):
+    """
+    Forwards connections accepted on a listening socket to channels opened by
+    channel_factory, servicing every connection from a single thread. Counts
+    the bytes sent to and received from the channels.
+
+    Channels are opened off that thread, as opening one can take a round trip
+    to the server or longer. Accepted clients wait unserviced until theirs is
+    ready.
+    """
+
+    def __init__(
+        self,
+        listen_sock,
+        channel_factory,
+        buffer_size=DEFAULT_BUFFER_SIZE,
+    ):
+        self.listen_sock = listen_sock
+        self.channel_factory = channel_factory
+        self.buffer_size = buffer_size
+        self.connections = set()
+        self.last_active = time.time()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._opened = collections.deque()
+        self._lock = threading.Lock()
+        self._closing = False
+        self._stopped = False
+        self._thread = None
+
+    @property
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self.listen_sock.setblocking(False)
+        self._wake_r.setblocking(False)
+        self._selector.register(
+            self.listen_sock,
+            selectors.EVENT_READ,
+            self._accept,
+        )
+        self._selector.register(
+            self._wake_r,
+            selectors.EVENT_READ,
+            self._wake,
+        )
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._wake_up()
+        if (
+            self._thread
+            and self._thread is not threading.current_thread()
+        ):
+            self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._closing:
+                if any(conn.to_channel for conn in self.connections):
+                    timeout = CHANNEL_RETRY_INTERVAL
+                else:
+                    timeout = None
+                for key, events in self._selector.select(timeout):
+                    key.data(key.fileobj, events)
+                for conn in list(self.connections):
+                    if conn.to_channel:
+                        self._flush_channel(conn)
+        finally:
+            with self._lock:
+                self._stopped = True
+            for conn in list(self.connections):
+                self._drop(conn)
+            while self._opened:
+                client, channel = self._opened.popleft()
+                client.close()
+                channel.close()
+            self._selector.close()
+            self._wake_r.close()
+            self._wake_w.close()
+
+    def _wake_up(self):
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass
+
+    def _wake(self, wake_sock, events):
+        try:
+            wake_sock.recv(64)
+        except OSError:
+            pass
+        while self._opened:
+            self._add(*self._opened.popleft())
+
+    def _accept(self, listen_sock, events):
+        try:
+            client, _ = listen_sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._closing = True
+            return
+
+        self.last_active = time.time()
+        threading.Thread(
+            target=self._open,
+            args=(client,),
+            daemon=True,
+        ).start()
+
+    def _open(self, client):
+        try:
+            channel = self.channel_factory()
+        except Exception:
+            client.close()
+            return
+
+        with self._lock:
+            if not self._stopped:
+                self._opened.append((client, channel))
+                self._wake_up()
+                return
+        client.close()
+        channel.close()
+
+    def _add(self, client, channel):
+        self.last_active = time.time()
+        client.setblocking(False)
+        channel.settimeout(0.0)
+        conn = _Connection(client, channel)
+        self.connections.add(conn)
+        self._update(conn)
+
+    def _update(self, conn):
+        if conn.finished:
+            self._drop(conn)
+            return
+
+        client_events = 0
+        if not conn.client_eof and not conn.to_channel:
+            client_events |= selectors.EVENT_READ
+        if conn.to_client:
+            client_events |= selectors.EVENT_WRITE
+        channel_events = 0
+        if not conn.channel_eof and not conn.to_client:
+            channel_events |= selectors.EVENT_READ
+
+        conn.client_events = self._register(
+            conn.client,
+            conn.client_events,
+            client_events,
+            lambda sock, events: self._client_ready(conn, events),
+        )
+        conn.channel_events = self._register(
+            conn.channel,
+            conn.channel_events,
+            channel_events,
+            lambda channel, events: self._channel_ready(conn),
+        )
+
+    def _register(self, fileobj, current, wanted, callback):
+        if current == wanted:
+            return wanted
+        if not wanted:
+            self._selector.unregister(fileobj)
+        elif not current:
+            self._selector.register(fileobj, wanted, callback)
+        else:
+            self._selector.modify(fileobj, wanted, callback)
+        return wanted
+
+    def _drop(self, conn):
+        if conn not in self.connections:
+            return
+        self.connections.discard(conn)
+        for fileobj, events in (
+            (conn.client, conn.client_events),
+            (conn.channel, conn.channel_events),
+        ):
+            if events:
+                self._selector.unregister(fileobj)
+        conn.client.close()
+        conn.channel.close()
+
+    def _client_ready(self, conn, events):
+        if conn not in self.connections:
+            return
+        self.last_active = time.time()
+        try:
+            if events & selectors.EVENT_WRITE:
+                sent = conn.client.send(conn.to_client)
+                conn.to_client = conn.to_client[sent:]
+            if events & selectors.EVENT_READ:
+                received = conn.client.recv_into(self._buffer)
+                self.bytes_sent += received
+                if received:
+                    self._send_channel(conn, self._view[:received])
+                else:
+                    conn.client_eof = True
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self._drop(conn)
+            return
+        self._half_close(conn)
+        self._update(conn)
+
+    def _channel_ready(self, conn):
+        if conn not in self.connections:
+            return
+        self.last_active = time.time()
+        try:
+            data = conn.channel.recv(self.buffer_size)
+        except socket.timeout:
+            return
+        except OSError:
+            self._drop(conn)
+            return
+        self.bytes_received += len(data)
+        if data:
+            try:
+                self._send_client(conn, data)
+            except OSError:
+                # The client went away while the channel was still sending.
+                self._drop(conn)
+                return
+        else:
+            conn.channel_eof = True
+        self._half_close(conn)
+        self._update(conn)
+
+    def _send_channel(self, conn, data):
+        # Each send only fills one SSH packet, so keep sending until the
+        # window is full rather than waiting for the next retry.
+        sent = 0
+        try:
+            while sent < len(data) and conn.channel.send_ready():
+                sent += conn.channel.send(data[sent:])
+        except socket.timeout:
+            pass
+        if sent < len(data):
+            conn.to_channel = bytes(data[sent:])
+
+    def _send_client(self, conn, data):
+        try:
+            sent = conn.client.send(data)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        if sent < len(data):
+            conn.to_client = data[sent:]
+
+    def _flush_channel(self, conn):
+        pending, conn.to_channel = conn.to_channel, b''
+        try:
+            self._send_channel(conn, pending)
+        except OSError:
+            self._drop(conn)
+            return
+        self._half_close(conn)
+        self._update(conn)
+
+    def _half_close(self, conn):
+        if conn.client_eof and not conn.to_channel and not conn.channel_shut:
+            conn.channel_shut = True
+            try:
+                conn.channel.shutdown_write()
+            except OSError:
+                pass
+        if conn.channel_eof and not conn.to_client and not conn.client_shut:
+            conn.client_shut = True
+            try:
+                conn.client.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
@@ -0,0 +1,13 @@
+import os
+
+
+CONFIG_DIR = os.path.expanduser('~/.hermes/')
+
+MB = 1024 * 1024
+
+# Settings for Manager, kept here so the CLI can configure it without
+# importing it.
+MANAGER_CONFIG = {}
+
+# The image helper containers are created from.
+HELPER_IMAGE = 'alpine'
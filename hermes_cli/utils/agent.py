@@ -0,0 +1,44 @@
+import json
+import os
+import socket
+
+from hermes_cli.utils import CONFIG_DIR
+
+
+AGENT_SOCKET = os.path.join(CONFIG_DIR, 'agent.sock')
+
+DEFAULT_IDLE_TIMEOUT = 600
+
+
+class AgentError(Exception):
+    pass
+
+
+def agent_request(command, socket_path=AGENT_SOCKET, timeout=None, **kwargs):
+    """
+    Sends a request to the hermes agent's control socket and returns the
+    decoded response, or None if no agent is listening.
+    """
+
+    if not os.path.exists(socket_path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+
+    with sock:
+        kwargs['command'] = command
+        sock.sendall(json.dumps(kwargs).encode('utf-8') + b'\n')
+        response = sock.makefile('rb').readline()
+
+    if not response:
+        raise AgentError('No response from agent')
+    response = json.loads(response.decode('utf-8'))
+    if 'error' in response:
+        raise AgentError(response['error'])
+    return response
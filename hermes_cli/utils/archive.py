@@ -0,0 +1,287 @@
+import copy
+import heapq
+import io
+import queue
+import tarfile
+import threading
+
+import click
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CHUNK_SIZE = 1024 * 1024
+
+QUEUE_SIZE = 8
+
+_DONE = object()
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _QueueWriter(object):
+    """
+    A write-only file object which puts what's written to it on a queue in
+    chunks of chunk_size bytes.
+    """
+
+    def __init__(self, chunks, cancelled, chunk_size=CHUNK_SIZE):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            self._put(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.buffer:
+            self._put(bytes(self.buffer))
+            self.buffer = bytearray()
+
+    def _put(self, chunk):
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise _Cancelled()
+
+
+def iter_archive(archive_data):
+    # Older versions of docker-py return the raw response from get_archive
+    # rather than a generator.
+    if hasattr(archive_data, 'read_chunked'):
+        return archive_data.read_chunked()
+    return archive_data
+
+
+class _Prefixed(object):
+    """
+    Puts bytes which have already been read from a stream back in front of it.
+    """
+
+    def __init__(self, prefix, fileobj):
+        self.prefix = prefix
+        self.fileobj = fileobj
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.fileobj.read(size)
+        if size < 0:
+            data, self.prefix = self.prefix + self.fileobj.read(), b''
+            return data
+        data, self.prefix = self.prefix[:size], self.prefix[size:]
+        if len(data) < size:
+            data += self.fileobj.read(size - len(data))
+        return data
+
+
+def open_decompressed(input_file):
+    """
+    Returns a stream of input_file's contents, decompressing them if they're
+    zstd compressed. tarfile's stream mode handles gzip, bzip2 and xz itself.
+    """
+
+    magic = input_file.read(len(ZSTD_MAGIC))
+    input_file = _Prefixed(magic, input_file)
+    if magic != ZSTD_MAGIC:
+        return input_file
+    if not zstandard:
+        raise click.ClickException(
+            'Restoring zstd compressed backups requires the zstandard '
+            'package. Please run pip install zstandard'
+        )
+    return zstandard.ZstdDecompressor().stream_reader(input_file)
+
+
+def empty_tar():
+    tar_data = io.BytesIO()
+    tarfile.open(fileobj=tar_data, mode='w').close()
+    return tar_data.getvalue()
+
+
+def strip_path(path, strip):
+    return "/".join(path.split('/')[strip:])
+
+
+def iter_tar(write_tar, chunk_size=CHUNK_SIZE, queue_size=QUEUE_SIZE):
+    """
+    Calls write_tar(output_tar) in a background thread with a streaming
+    tarfile, and yields the archive it writes in chunks. At most queue_size
+    chunks are buffered, so memory use doesn't depend on the archive's size.
+    """
+
+    chunks = queue.Queue(maxsize=queue_size)
+    cancelled = threading.Event()
+    errors = []
+
+    def _write():
+        writer = _QueueWriter(chunks, cancelled, chunk_size)
+        try:
+            output_tar = tarfile.open(fileobj=writer, mode='w|')
+            write_tar(output_tar)
+            output_tar.close()
+            writer.close()
+        except _Cancelled:
+            pass
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            chunks.put(_DONE)
+
+    write_thread = threading.Thread(target=_write, daemon=True)
+    write_thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is _DONE:
+                break
+            yield chunk
+    finally:
+        cancelled.set()
+        while write_thread.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        write_thread.join()
+
+    if errors:
+        raise errors[0]
+
+
+def _strip_member(member, strip):
+    member_name = strip_path(member.name, strip)
+    if not member_name:
+        return None
+    member = copy.copy(member)
+    # Long and non-ASCII paths come with PAX headers, which take priority
+    # over name and linkname when the member is written, so they're dropped
+    # and written again from the stripped names.
+    member.pax_headers = dict(member.pax_headers)
+    member.name = member_name
+    member.pax_headers.pop('path', None)
+    if member.islnk():
+        member.linkname = strip_path(member.linkname, strip)
+        member.pax_headers.pop('linkpath', None)
+    return member
+
+
+def strip_tar(input_file, strip, **kwargs):
+    """
+    Yields chunks of a tar archive containing the members of the archive read
+    from input_file, with the first strip components removed from their paths.
+    The input is read sequentially, so it can be a pipe or stdin.
+    """
+
+    def _write_tar(output_tar):
+        input_tar = tarfile.open(
+            fileobj=open_decompressed(input_file),
+            mode='r|*',
+        )
+        for member in input_tar:
+            output_member = _strip_member(member, strip)
+            if not output_member:
+                continue
+            if member.isreg():
+                output_tar.addfile(
+                    output_member,
+                    input_tar.extractfile(member),
+                )
+            else:
+                output_tar.addfile(output_member)
+
+    return iter_tar(_write_tar, **kwargs)
+
+
+def is_plain_tar(path):
+    try:
+        tarfile.open(path, mode='r:').close()
+    except (OSError, tarfile.TarError):
+        return False
+    return True
+
+
+def plan_shards(members, shards):
+    """
+    Splits the non-directory members of an archive into at most shards lists
+    of roughly equal size. Hard links are kept in the same list as their
+    targets, and each list keeps the archive's order.
+    """
+
+    groups = {}
+    roots = {}
+    for position, member in enumerate(members):
+        if member.isdir():
+            continue
+        if member.islnk():
+            root = roots.get(member.linkname, member.linkname)
+        else:
+            root = member.name
+        roots[member.name] = root
+        groups.setdefault(root, []).append((position, member))
+
+    def group_size(group):
+        return sum(member.size + tarfile.BLOCKSIZE for _, member in group)
+
+    planned = [(0, index, []) for index in range(shards)]
+    for group in sorted(groups.values(), key=group_size, reverse=True):
+        size, index, shard = heapq.heappop(planned)
+        shard.extend(group)
+        heapq.heappush(planned, (size + group_size(group), index, shard))
+    return [
+        [member for _, member in sorted(shard, key=lambda item: item[0])]
+        for _, _, shard in sorted(planned, key=lambda item: item[1])
+        if shard
+    ]
+
+
+def shard_tar(path, shards, strip, **kwargs):
+    """
+    Splits the uncompressed tar archive at path into at most shards archives
+    of roughly equal size, returning an iterator over each like strip_tar's.
+    Every shard contains all of the archive's directories, so the shards can
+    be extracted independently and in any order.
+    """
+
+    with tarfile.open(path, mode='r:') as input_tar:
+        members = input_tar.getmembers()
+    directories = [member for member in members if member.isdir()]
+
+    def _shard(shard_members):
+        def _write_tar(output_tar):
+            with tarfile.open(path, mode='r:') as input_tar:
+                for member in directories + shard_members:
+                    output_member = _strip_member(member, strip)
+                    if not output_member:
+                        continue
+                    if member.isreg():
+                        output_tar.addfile(
+                            output_member,
+                            input_tar.extractfile(member),
+                        )
+                    else:
+                        output_tar.addfile(output_member)
+
+        return iter_tar(_write_tar, **kwargs)
+
+    return [
+        _shard(shard_members)
+        for shard_members in plan_shards(members, shards) or [[]]
+    ]
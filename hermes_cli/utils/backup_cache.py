@@ -0,0 +1,168 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import botocore.exceptions
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from hermes_cli.utils import CONFIG_DIR
+from hermes_cli.utils.cache import JSONCache
+
+
+BACKUP_CACHE_DIR = os.path.join(CONFIG_DIR, 'backup_cache')
+
+BACKUP_CACHE_KEY_FILE = os.path.join(CONFIG_DIR, 'backup_cache.key')
+
+# Set to a Fernet key to keep the key out of ~/.hermes altogether.
+BACKUP_CACHE_KEY_ENV = 'HERMES_BACKUP_CACHE_KEY'
+
+DEFAULT_BACKUP_CACHE_SIZE = 64 * 1024 * 1024
+
+NOT_MODIFIED_CODES = ('304', 'NotModified')
+
+
+def backup_cache_enabled(config, kind):
+    """
+    Backups are cached unless backup_cache is off in the config, except for
+    secrets, which are only cached if cache_secrets is on.
+    """
+
+    if not config.get('backup_cache', True):
+        return False
+    return kind != 'secrets' or config.get('cache_secrets', False)
+
+
+class BackupCache(object):
+    """
+    A local, encrypted copy of S3 objects, revalidated with a conditional GET
+    each time it's used. Least recently used entries are evicted once the
+    entries add up to more than max_size bytes.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(
+        self,
+        max_size=DEFAULT_BACKUP_CACHE_SIZE,
+        path=BACKUP_CACHE_DIR,
+        key_file=BACKUP_CACHE_KEY_FILE,
+    ):
+        self.max_size = max_size
+        self.path = path
+        self.key_file = key_file
+        self.index = JSONCache(os.path.join(path, 'index.json'))
+        self._fernet = None
+
+    def get_object(self, client, bucket, key):
+        entry_id = hashlib.sha256(
+            '{}/{}'.format(bucket, key).encode('utf-8'),
+        ).hexdigest()
+        with self._lock:
+            entry = self.index.load().get(entry_id)
+        cached = self._read(entry_id) if entry else None
+
+        kwargs = {}
+        if cached is not None:
+            kwargs['IfNoneMatch'] = entry['etag']
+        try:
+            response = client.get_object(Bucket=bucket, Key=key, **kwargs)
+        except botocore.exceptions.ClientError as e:
+            if (
+                cached is not None
+                and e.response['Error']['Code'] in NOT_MODIFIED_CODES
+            ):
+                self._touch(entry_id)
+                return cached
+            raise
+
+        data = response['Body'].read()
+        self._write(entry_id, data, response['ETag'])
+        return data
+
+    def _cipher(self):
+        if self._fernet:
+            return self._fernet
+
+        key = os.environ.get(BACKUP_CACHE_KEY_ENV, '').encode('ascii')
+        if not key:
+            with self._lock:
+                key = self._load_key()
+        self._fernet = Fernet(key)
+        return self._fernet
+
+    def _load_key(self):
+        try:
+            with open(self.key_file, 'rb') as key_f:
+                return key_f.read().strip()
+        except (IOError, OSError):
+            pass
+
+        # The new key is written to a file of its own and then linked into
+        # place, which fails if another hermes process got there first, so
+        # the key file is never seen half written or replaced.
+        key_dir = os.path.dirname(self.key_file)
+        os.makedirs(key_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=key_dir)
+        try:
+            with os.fdopen(fd, 'wb') as key_f:
+                key_f.write(Fernet.generate_key())
+            os.link(tmp_path, self.key_file)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+        with open(self.key_file, 'rb') as key_f:
+            return key_f.read().strip()
+
+    def _entry_path(self, entry_id):
+        return os.path.join(self.path, entry_id)
+
+    def _read(self, entry_id):
+        try:
+            with open(self._entry_path(entry_id), 'rb') as entry_f:
+                return self._cipher().decrypt(entry_f.read())
+        except (IOError, OSError, InvalidToken):
+            # Missing, or encrypted with a different key.
+            return None
+
+    def _write(self, entry_id, data, etag):
+        token = self._cipher().encrypt(data)
+        try:
+            os.makedirs(self.path, mode=0o700, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fd, 'wb') as entry_f:
+                entry_f.write(token)
+            os.replace(tmp_path, self._entry_path(entry_id))
+        except (IOError, OSError):
+            return
+
+        with self._lock:
+            index = self.index.load()
+            index[entry_id] = {
+                'etag': etag,
+                'size': len(token),
+                'used': time.time(),
+            }
+            self._evict(index)
+            self.index.save(index)
+
+    def _touch(self, entry_id):
+        with self._lock:
+            index = self.index.load()
+            if entry_id in index:
+                index[entry_id]['used'] = time.time()
+                self.index.save(index)
+
+    def _evict(self, index):
+        total = sum(entry['size'] for entry in index.values())
+        for entry_id in sorted(index, key=lambda e: index[e]['used']):
+            if total <= self.max_size:
+                break
+            total -= index.pop(entry_id)['size']
+            try:
+                os.remove(self._entry_path(entry_id))
+            except OSError:
+                pass
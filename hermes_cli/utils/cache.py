@@ -0,0 +1,132 @@
+import json
+import os
+import tempfile
+import time
+
+from hermes_cli.utils import CONFIG_DIR
+
+
+MANAGER_CACHE_FILE = os.path.join(CONFIG_DIR, 'managers.json')
+
+LAST_GOOD_CACHE_FILE = os.path.join(CONFIG_DIR, 'last_good_managers.json')
+
+DEFAULT_MANAGER_CACHE_TTL = 300
+
+BOOTSTRAP_CACHE_FILE = os.path.join(CONFIG_DIR, 'bootstrap.json')
+
+# Entries for instances which haven't been used for this long are dropped.
+BOOTSTRAP_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+CACHED_INSTANCE_KEYS = (
+    'InstanceId',
+    'LaunchTime',
+    'PublicDnsName',
+    'State',
+    'Tags',
+)
+
+
+class JSONCache(object):
+    """
+    A small dict persisted as JSON, written atomically so concurrent hermes
+    processes never see a partial file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as cache_f:
+                return json.load(cache_f)
+        except (IOError, ValueError):
+            return {}
+
+    def save(self, data):
+        cache_dir = os.path.dirname(self.path)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, 'w') as cache_f:
+                json.dump(data, cache_f, default=str)
+            os.replace(tmp_path, self.path)
+        except (IOError, OSError):
+            pass
+
+    def update(self, key, value):
+        data = self.load()
+        if value is None:
+            data.pop(key, None)
+        else:
+            data[key] = value
+        self.save(data)
+
+
+class ManagerCache(JSONCache):
+    def __init__(self, ttl=DEFAULT_MANAGER_CACHE_TTL, path=MANAGER_CACHE_FILE):
+        super(ManagerCache, self).__init__(path)
+        self.ttl = ttl
+
+    def get(self, stack):
+        entry = self.load().get(stack)
+        if not entry or time.time() - entry['updated'] > self.ttl:
+            return None
+        return entry['instances']
+
+    def put(self, stack, instances):
+        self.update(stack, {
+            'updated': time.time(),
+            'instances': [
+                {key: instance.get(key) for key in CACHED_INSTANCE_KEYS}
+                for instance in instances
+            ],
+        })
+
+    def invalidate(self, stack):
+        self.update(stack, None)
+
+
+class LastGoodCache(JSONCache):
+    def __init__(self, path=LAST_GOOD_CACHE_FILE):
+        super(LastGoodCache, self).__init__(path)
+
+    def get(self, stack):
+        return self.load().get(stack)
+
+    def put(self, stack, instance_id):
+        if self.get(stack) != instance_id:
+            self.update(stack, instance_id)
+
+
+class BootstrapCache(JSONCache):
+    """
+    What Manager.bootstrap found on each manager, keyed by instance ID and
+    launch time, so that replaced or restarted instances are probed again.
+    """
+
+    def __init__(
+        self,
+        max_age=BOOTSTRAP_CACHE_MAX_AGE,
+        path=BOOTSTRAP_CACHE_FILE,
+    ):
+        super(BootstrapCache, self).__init__(path)
+        self.max_age = max_age
+
+    def key(self, instance):
+        return '{} {}'.format(instance['InstanceId'], instance['LaunchTime'])
+
+    def get(self, instance):
+        entry = self.load().get(self.key(instance))
+        return entry['remote'] if entry else None
+
+    def put(self, instance, remote):
+        data = {
+            key: entry for key, entry in self.load().items()
+            if time.time() - entry['updated'] < self.max_age
+        }
+        data[self.key(instance)] = {
+            'updated': time.time(),
+            'remote': remote,
+        }
+        self.save(data)
@@ -0,0 +1,208 @@
+import contextlib
+import io
+import shlex
+import tarfile
+import time
+
+import click
+import docker.errors
+
+from hermes_cli.utils import HELPER_IMAGE
+
+
+# Keeps a helper container running so commands can be run in it with exec.
+KEEPALIVE_COMMAND = ['tail', '-f', '/dev/null']
+
+STDERR_PATH = '/tmp/hermes-stderr'
+
+FILE_LIST_PATH = '/tmp/hermes-files'
+
+HELPER_LABEL = 'hermes.volume'
+
+# How often to check whether an exec has finished after its output ends.
+EXEC_POLL_INTERVAL = 0.05
+
+COMPRESSORS = {
+    'gzip': {
+        'command': 'gzip -{level} -c',
+        'level': 6,
+        'suffix': '.gz',
+    },
+    'zstd': {
+        'command': 'zstd -q -{level} -c',
+        'level': 3,
+        'suffix': '.zst',
+        'package': 'zstd',
+    },
+}
+
+
+class RemoteCommandError(click.ClickException):
+    pass
+
+
+def volume_path(volume_name):
+    return '/mnt/{}'.format(volume_name)
+
+
+def create_helper(manager, volume_name, driver, mode='ro', keepalive=False):
+    """
+    Creates a container with volume_name mounted at /mnt/<volume_name>. If
+    keepalive is set, the container is started and left running so that
+    commands can be run in it.
+    """
+
+    manager.ensure_image(HELPER_IMAGE)
+    helper = manager.docker.containers.create(
+        image=HELPER_IMAGE,
+        command=KEEPALIVE_COMMAND if keepalive else None,
+        volume_driver=driver,
+        labels={HELPER_LABEL: volume_name},
+        volumes={
+            volume_name: {
+                'bind': volume_path(volume_name),
+                'mode': mode,
+            },
+        },
+    )
+    if keepalive:
+        helper.start()
+    return helper
+
+
+@contextlib.contextmanager
+def open_helper(manager, volume_name, driver, mode='ro', keepalive=False):
+    """
+    Creates a helper container like create_helper, and removes it again when
+    the block exits, whether or not it raised.
+    """
+
+    helper = create_helper(manager, volume_name, driver, mode, keepalive)
+    try:
+        yield helper
+    finally:
+        remove_helper(manager, helper.id)
+
+
+def remove_helper(manager, helper_id):
+    try:
+        manager.docker.api.remove_container(helper_id, force=True)
+    except docker.errors.NotFound:
+        pass
+    except Exception as e:
+        click.echo(
+            "Warning: Couldn't remove helper container {}: {}".format(
+                helper_id[:12],
+                e,
+            ),
+            err=True,
+        )
+
+
+def _exec(manager, helper, args):
+    api = manager.docker.api
+    exec_id = api.exec_create(
+        helper.id,
+        args,
+        stdout=True,
+        stderr=False,
+    )['Id']
+    for chunk in api.exec_start(exec_id, stream=True):
+        yield chunk
+    # The output can end before the daemon has the exit code, which it
+    # reports as None while the exec is still running.
+    while True:
+        exec_info = api.exec_inspect(exec_id)
+        if not exec_info['Running']:
+            return exec_info['ExitCode']
+        time.sleep(EXEC_POLL_INTERVAL)
+
+
+def exec_stream(manager, helper, command):
+    """
+    Runs a shell command in a running helper container, yielding its stdout
+    as it arrives. Raises RemoteCommandError, including the command's stderr,
+    if the command exits with a non-zero status.
+    """
+
+    exit_code = yield from _exec(manager, helper, [
+        'sh',
+        '-c',
+        'set -o pipefail; ({}) 2>{}'.format(command, STDERR_PATH),
+    ])
+    if exit_code:
+        stderr = b''.join(_exec(manager, helper, ['cat', STDERR_PATH]))
+        raise RemoteCommandError(
+            "{} exited with status {}: {}".format(
+                command,
+                exit_code,
+                stderr.decode('utf-8', 'replace').strip(),
+            )
+        )
+
+
+def exec_output(manager, helper, command):
+    return b''.join(exec_stream(manager, helper, command))
+
+
+def put_file(helper, path, data):
+    """
+    Writes data to path in the helper container.
+    """
+
+    directory, _, name = path.rpartition('/')
+    tar_data = io.BytesIO()
+    with tarfile.open(fileobj=tar_data, mode='w') as tar:
+        member = tarfile.TarInfo(name)
+        member.size = len(data)
+        tar.addfile(member, io.BytesIO(data))
+    helper.put_archive(directory or '/', tar_data.getvalue())
+
+
+def fingerprint_command(volume_name):
+    """
+    Returns a shell command which prints a hash of the name, size, mtime,
+    mode and owner of everything in the volume. Archives of volumes with the
+    same fingerprint are byte for byte identical.
+    """
+
+    return (
+        "cd /mnt && find {} -exec stat -c '%n %s %Y %a %u %g' {{}} + "
+        "| sha256sum"
+    ).format(shlex.quote(volume_name))
+
+
+def archive_command(
+    volume_name,
+    compress=None,
+    level=None,
+    file_list=None,
+    offset=0,
+):
+    """
+    Returns a shell command which writes a tar of the volume to stdout, with
+    members under <volume_name>/ like get_archive's, optionally compressed.
+    If file_list is given, only the paths listed in that file are included.
+    If offset is given, the first offset bytes of the output are skipped.
+    """
+
+    if file_list:
+        command = 'tar -C /mnt -cf - -T {}'.format(shlex.quote(file_list))
+    else:
+        command = 'tar -C /mnt -cf - {}'.format(shlex.quote(volume_name))
+    if compress:
+        compressor = COMPRESSORS[compress]
+        command = '{} | {}'.format(
+            command,
+            compressor['command'].format(
+                level=level or compressor['level'],
+            ),
+        )
+        if compressor.get('package'):
+            command = 'apk add --no-cache -q {} && {}'.format(
+                compressor['package'],
+                command,
+            )
+    if offset:
+        command = '{} | tail -c +{}'.format(command, offset + 1)
+    return command
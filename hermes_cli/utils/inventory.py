@@ -0,0 +1,180 @@
+import base64
+import hashlib
+import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import dateutil.parser
+
+from hermes_cli.manager import Manager
+from hermes_cli.utils.timings import TIMINGS
+from hermes_cli.utils.backup_cache import (
+    DEFAULT_BACKUP_CACHE_SIZE,
+    BackupCache,
+    backup_cache_enabled,
+)
+
+
+# Configs and secrets created by hermes are labelled with a hash of their
+# data, and their backups have it in their metadata.
+HASH_LABEL = 'hermes.sha256'
+
+HASH_METADATA = 'sha256'
+
+_s3 = None
+
+_s3_lock = threading.Lock()
+
+
+def s3_resource():
+    # boto3 is slow to import, so the resource is only created when it's
+    # first needed. Creating resources isn't thread safe, hence the lock.
+    global _s3
+    with _s3_lock:
+        if _s3 is None:
+            import boto3
+            _s3 = boto3.resource('s3')
+            TIMINGS.instrument_boto(_s3.meta.client)
+    return _s3
+
+
+def s3_client():
+    return s3_resource().meta.client
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def original_hash(original):
+    spec = original['Spec']
+    label = (spec.get('Labels') or {}).get(HASH_LABEL)
+    if label:
+        return label
+    # Configs include their data, so unlabelled ones can still be compared.
+    # Secrets don't.
+    if spec.get('Data'):
+        return content_hash(base64.b64decode(spec['Data']))
+    return None
+
+
+def s3_path(kind, swarm_name, name=''):
+    return 'swarms/{}/{}/{}'.format(swarm_name, kind, name)
+
+
+def s3_config_bucket(ctx):
+    config_bucket = ctx.find_root().config.get('s3_config_bucket')
+    if not config_bucket:
+        click.echo(
+            'No s3_config_bucket configured! Please run hermes configure',
+            err=True,
+        )
+        sys.exit(1)
+    return config_bucket
+
+
+def get_backups(config_bucket, prefix):
+    backups = {}
+    # The delimiter stops the listing descending below the swarm's prefix.
+    paginator = s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(
+        Bucket=config_bucket,
+        Prefix=prefix,
+        Delimiter='/',
+    ):
+        for s3_obj in page.get('Contents', []):
+            name = s3_obj['Key'][len(prefix):]
+            if not name:
+                continue
+            backups[name] = {
+                'id': '-',
+                'name': name,
+                'backup': '-',
+                'modified': s3_obj['LastModified'],
+            }
+    return backups
+
+
+def get_originals(manager, kind):
+    # The low-level API returns plain dicts, which is all that's needed here,
+    # rather than building a model object for each item.
+    originals = {}
+    for original in getattr(manager.docker.api, kind)():
+        name = original['Spec']['Name']
+        originals[name] = {
+            'id': original['ID'],
+            'name': name,
+            'modified': dateutil.parser.parse(original['UpdatedAt']),
+            'sha256': original_hash(original),
+        }
+    return originals
+
+
+def get_inventory(ctx, kind, swarm_name, manager=None, skip_backups=False):
+    """
+    Lists the backups in S3 and the originals in the swarm for kind (either
+    "configs" or "secrets"), fetching both at the same time.
+    """
+
+    config_bucket = s3_config_bucket(ctx)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        if not skip_backups:
+            backups_future = executor.submit(
+                get_backups,
+                config_bucket,
+                s3_path(kind, swarm_name),
+            )
+
+        if manager:
+            originals = get_originals(manager, kind)
+        else:
+            with Manager.find(swarm_name) as manager:
+                originals = get_originals(manager, kind)
+
+        backups = {} if skip_backups else backups_future.result()
+
+    for name, original in originals.items():
+        original['backup'] = '*' if name in backups else '!'
+
+    return {
+        'backups': backups,
+        'originals': originals,
+    }
+
+
+def get_backup(ctx, kind, swarm_name, name):
+    config = ctx.find_root().config
+    config_bucket = s3_config_bucket(ctx)
+    key = s3_path(kind, swarm_name, name)
+    # Uses the resource's client, which unlike the resource is thread safe.
+    if backup_cache_enabled(config, kind):
+        return BackupCache(
+            config.get('backup_cache_size', DEFAULT_BACKUP_CACHE_SIZE),
+        ).get_object(s3_client(), config_bucket, key)
+    return s3_client().get_object(
+        Bucket=config_bucket,
+        Key=key,
+    )['Body'].read()
+
+
+def put_backup(config_bucket, kind, swarm_name, name, data):
+    # Called from worker threads by sync, so this uses the client too.
+    s3_client().put_object(
+        Bucket=config_bucket,
+        Key=s3_path(kind, swarm_name, name),
+        ServerSideEncryption='aws:kms',
+        ACL='private',
+        Body=data,
+        Metadata={HASH_METADATA: content_hash(data)},
+    )
+
+
+def create_original(manager, kind, name, data):
+    getattr(manager.docker, kind).create(
+        name=name,
+        data=data,
+        labels={HASH_LABEL: content_hash(data)},
+    )
@@ -0,0 +1,31 @@
+import hashlib
+import os
+
+from hermes_cli.utils import CONFIG_DIR, MB
+from hermes_cli.utils.cache import JSONCache
+
+
+JOURNAL_DIR = os.path.join(CONFIG_DIR, 'journals')
+
+# How much backup data is written between journal updates.
+CHECKPOINT_SIZE = 64 * MB
+
+
+class Journal(JSONCache):
+    """
+    Records the progress of a volume transfer, so that running the same
+    command again after it's interrupted can carry on where it stopped. key is
+    a tuple of everything which identifies the transfer.
+    """
+
+    def __init__(self, key, journal_dir=JOURNAL_DIR):
+        name = hashlib.sha256('\0'.join(key).encode('utf-8')).hexdigest()
+        super(Journal, self).__init__(
+            os.path.join(journal_dir, '{}.json'.format(name)),
+        )
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
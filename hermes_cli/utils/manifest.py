@@ -0,0 +1,60 @@
+import shlex
+
+
+MANIFEST_SUFFIX = '.manifest.json'
+
+
+def manifest_command(volume_name):
+    """
+    Returns a shell command which lists the volume's regular files with their
+    size, mtime and SHA-256, and its symlinks, one per line with the path last.
+    """
+
+    volume = shlex.quote(volume_name)
+    return (
+        "cd /mnt && "
+        "find {volume} -type f -exec stat -c 'S %s %Y %n' {{}} + && "
+        "find {volume} -type f -exec sha256sum {{}} + | sed 's/^/H /' && "
+        "find {volume} -type l | sed 's/^/L /'"
+    ).format(volume=volume)
+
+
+def parse_manifest(output):
+    """
+    Parses the output of manifest_command into a dict mapping each path to
+    [size, mtime, sha256]. Symlinks have a size and mtime of 0 and no hash.
+    """
+
+    files = {}
+    hashes = {}
+    for line in output.decode('utf-8', 'replace').splitlines():
+        if line.startswith('S '):
+            _, size, mtime, path = line.split(' ', 3)
+            files[path] = [int(size), int(mtime), None]
+        elif line.startswith('H '):
+            _, sha256, path = line.split(' ', 2)
+            # sha256sum separates the hash from the path with two spaces.
+            hashes[path[1:]] = sha256
+        elif line.startswith('L '):
+            files[line[2:]] = [0, 0, None]
+    for path, sha256 in hashes.items():
+        if path in files:
+            files[path][2] = sha256
+    return files
+
+
+def diff_manifests(previous_files, files):
+    """
+    Returns the paths which are new or have changed since previous_files, and
+    the paths which have been deleted. Symlinks are always treated as changed
+    since they're tiny and don't have a hash.
+    """
+
+    changed = sorted(
+        path for path, (size, mtime, sha256) in files.items()
+        if sha256 is None
+        or path not in previous_files
+        or previous_files[path][2] != sha256
+    )
+    deleted = sorted(set(previous_files) - set(files))
+    return changed, deleted
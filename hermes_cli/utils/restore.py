@@ -0,0 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+DEFAULT_JOBS = 8
+
+
+def restore_backups(names, download, create, jobs=DEFAULT_JOBS):
+    """
+    Downloads the backups for names with up to jobs concurrent calls to
+    download(name), and calls create(name, data) for each one as it arrives.
+
+    Failures are collected rather than raised, so one bad item doesn't abort
+    the batch. Returns a list of restored names and a list of (name, error)
+    pairs for failures.
+    """
+
+    restored = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(download, name): name for name in names}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                create(name, future.result())
+            except Exception as e:
+                failed.append((name, e))
+                continue
+            restored.append(name)
+    return restored, failed
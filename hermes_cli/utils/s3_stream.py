@@ -0,0 +1,157 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+PART_SIZE = 16 * 1024 * 1024
+
+MAX_IN_FLIGHT = 4
+
+
+def parse_s3_url(url):
+    """
+    Returns (bucket, key) for an s3://bucket/key URL, with either part empty
+    if it's missing, or None if url isn't an S3 URL.
+    """
+
+    if not url.startswith('s3://'):
+        return None
+    bucket, _, key = url[len('s3://'):].partition('/')
+    return bucket, key
+
+
+class MultipartUpload(object):
+    """
+    A write-only file object which uploads what's written to it to S3 as a
+    multipart upload, with at most max_in_flight parts being uploaded at once.
+    Used as a context manager, the upload is completed on success and aborted
+    if an exception is raised, unless abort_on_error is False.
+
+    An interrupted upload can be carried on by passing the upload_id and the
+    parts from checkpoint(), and writing the data from checkpoint()'s offset.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket,
+        key,
+        part_size=PART_SIZE,
+        max_in_flight=MAX_IN_FLIGHT,
+        upload_id=None,
+        parts=(),
+        abort_on_error=True,
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.abort_on_error = abort_on_error
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._completed = list(parts)
+        self._parts = []
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.upload_id = upload_id or client.create_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            ACL='private',
+            ServerSideEncryption='aws:kms',
+        )['UploadId']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not exc_type:
+            self.close()
+        elif self.abort_on_error:
+            self.abort()
+        else:
+            self._executor.shutdown()
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def checkpoint(self, wait_for_parts=False):
+        """
+        Returns the parts uploaded so far which follow on from each other,
+        and the offset in the data that they reach. If wait_for_parts is set,
+        parts which are still uploading are waited for first.
+        """
+
+        if wait_for_parts:
+            wait(self._parts)
+        parts = list(self._completed)
+        for part in self._parts:
+            if not part.done() or part.exception():
+                break
+            parts.append(part.result())
+        return {
+            'upload_id': self.upload_id,
+            'parts': parts,
+            'offset': len(parts) * self.part_size,
+        }
+
+    def close(self):
+        if self._buffer or not (self._parts or self._completed):
+            self._upload_part(bytes(self._buffer))
+            self._buffer = bytearray()
+        try:
+            parts = self._completed + [part.result() for part in self._parts]
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._executor.shutdown()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={'Parts': parts},
+        )
+
+    def abort(self):
+        self._executor.shutdown()
+        self.client.abort_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+        )
+
+    def _upload_part(self, data):
+        # Blocks while max_in_flight parts are already uploading, which also
+        # bounds how much is buffered in memory.
+        self._slots.acquire()
+        for part in self._parts:
+            if part.done() and part.exception():
+                self._slots.release()
+                raise part.exception()
+        part_number = len(self._completed) + len(self._parts) + 1
+        self._parts.append(self._executor.submit(
+            self._send_part,
+            part_number,
+            data,
+        ))
+
+    def _send_part(self, part_number, data):
+        try:
+            response = self.client.upload_part(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                PartNumber=part_number,
+                Body=data,
+            )
+        finally:
+            self._slots.release()
+        return {
+            'ETag': response['ETag'],
+            'PartNumber': part_number,
+        }
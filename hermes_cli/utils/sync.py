@@ -0,0 +1,187 @@
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+import botocore.exceptions
+import click
+
+from hermes_cli.utils import inventory
+from hermes_cli.utils.inventory import (
+    HASH_METADATA,
+    content_hash,
+    s3_config_bucket,
+    s3_path,
+)
+from hermes_cli.utils.restore import DEFAULT_JOBS
+
+
+def read_directory(directory):
+    """
+    Reads each regular, non-hidden file in directory, named after the file.
+    """
+
+    items = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.startswith('.') or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as item_f:
+            items[name] = item_f.read()
+    return items
+
+
+def get_backup_hash(config_bucket, kind, swarm_name, name):
+    try:
+        response = inventory.s3_client().head_object(
+            Bucket=config_bucket,
+            Key=s3_path(kind, swarm_name, name),
+        )
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+    # Backups made before hashes were recorded have no metadata, and are
+    # treated as changed so that they gain it.
+    return response.get('Metadata', {}).get(HASH_METADATA, '')
+
+
+def plan_sync(
+    ctx,
+    kind,
+    swarm_name,
+    manager,
+    items,
+    backup=True,
+    jobs=DEFAULT_JOBS,
+):
+    """
+    Compares items, a dict of name to data, with the originals in the swarm
+    and their backups in S3. Returns a dict of name to (swarm action, S3
+    action), where the swarm action is one of "create", "same", "differs"
+    (which can't be fixed, as configs and secrets are immutable) or "unknown"
+    (for originals without a recorded hash), and the S3 action is one of
+    "upload", "same" or None. Backups are only uploaded for items which match
+    or will match the swarm, and not at all if backup is False.
+    """
+
+    current = inventory.get_inventory(
+        ctx,
+        kind,
+        swarm_name,
+        manager,
+        skip_backups=not backup,
+    )
+    hashes = {name: content_hash(data) for name, data in items.items()}
+
+    backup_hashes = {}
+    if backup:
+        config_bucket = s3_config_bucket(ctx)
+        backed_up = [name for name in items if name in current['backups']]
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            backup_hashes = dict(zip(backed_up, executor.map(
+                lambda name: get_backup_hash(
+                    config_bucket,
+                    kind,
+                    swarm_name,
+                    name,
+                ),
+                backed_up,
+            )))
+
+    plan = {}
+    for name in items:
+        original = current['originals'].get(name)
+        if not original:
+            swarm_action = 'create'
+        elif not original['sha256']:
+            swarm_action = 'unknown'
+        elif original['sha256'] == hashes[name]:
+            swarm_action = 'same'
+        else:
+            swarm_action = 'differs'
+
+        s3_action = None
+        if backup and swarm_action in ('create', 'same'):
+            if backup_hashes.get(name) == hashes[name]:
+                s3_action = 'same'
+            else:
+                s3_action = 'upload'
+        plan[name] = (swarm_action, s3_action)
+    return plan
+
+
+def echo_plan(plan):
+    for name, (swarm_action, s3_action) in sorted(plan.items()):
+        click.echo(
+            "{:<8} {:<7} {}".format(swarm_action, s3_action or '-', name),
+        )
+
+
+def sync_items(
+    ctx,
+    kind,
+    swarm_name,
+    manager,
+    items,
+    backup=True,
+    dry_run=False,
+    jobs=DEFAULT_JOBS,
+):
+    """
+    Creates the items which are missing from the swarm, and uploads backups
+    of those whose backups are missing or out of date, all at the same time.
+    Returns the names of items which differ from the originals in the swarm.
+    """
+
+    plan = plan_sync(ctx, kind, swarm_name, manager, items, backup, jobs)
+    echo_plan(plan)
+
+    differs = sorted(
+        name for name, (swarm_action, _) in plan.items()
+        if swarm_action == 'differs'
+    )
+    for name in differs:
+        click.echo(
+            "Error: {} differs from the one in the swarm, which can't be "
+            "changed. Use a new name for the new version.".format(name),
+            err=True,
+        )
+    if dry_run:
+        return differs
+
+    create_names = [
+        name for name, (swarm_action, _) in plan.items()
+        if swarm_action == 'create'
+    ]
+    upload_names = [
+        name for name, (_, s3_action) in plan.items()
+        if s3_action == 'upload'
+    ]
+    if upload_names:
+        config_bucket = s3_config_bucket(ctx)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        uploads = [
+            executor.submit(
+                inventory.put_backup,
+                config_bucket,
+                kind,
+                swarm_name,
+                name,
+                items[name],
+            )
+            for name in upload_names
+        ]
+        for name in create_names:
+            inventory.create_original(manager, kind, name, items[name])
+        for upload in uploads:
+            upload.result()
+
+    click.echo(
+        "Created {} {}, uploaded {} backups".format(
+            len(create_names),
+            kind,
+            len(upload_names),
+        ),
+    )
+    return differs
@@ -0,0 +1,277 @@
+import collections
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+
+# Docker object IDs in API paths, which are replaced so calls group together.
+DOCKER_ID = re.compile(r'/[0-9a-zA-Z]{20,}(?=/|$)')
+
+DOCKER_VERSION = re.compile(r'^/v[0-9.]+')
+
+
+def body_size(body):
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    try:
+        position = body.tell()
+        size = body.seek(0, os.SEEK_END)
+        body.seek(position)
+    except (AttributeError, OSError, ValueError):
+        return None
+    return size - position
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    def __init__(self, timings, name, args):
+        self.timings = timings
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.args['error'] = exc_type.__name__
+        self.timings.add(
+            self.name,
+            self.start,
+            time.time() - self.start,
+            **self.args
+        )
+
+    def set(self, **args):
+        self.args.update(args)
+
+
+class Timings(object):
+    """
+    Records how long each phase of a command takes, as named spans, and
+    totals of counters such as bytes through the tunnel. Recording does
+    nothing until enable() is called.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.started = None
+        self.spans = []
+        self.counters = collections.Counter()
+        self._lock = threading.Lock()
+        self._boto_starts = threading.local()
+
+    def enable(self):
+        self.enabled = True
+        self.started = time.time()
+
+    def span(self, name, **args):
+        """
+        Returns a context manager which records a span covering its block.
+        Arguments are kept with the span, and more can be added with set().
+        """
+
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def timed(self, name):
+        """
+        Decorates a function to record a span for each call.
+        """
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add(self, name, start, duration, **args):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.spans.append((
+                name,
+                start,
+                duration,
+                threading.current_thread().name,
+                args,
+            ))
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += value
+
+    def instrument_docker(self, api):
+        """
+        Records a span for each request made with a docker-py APIClient,
+        lasting until its response headers arrive.
+        """
+
+        if not self.enabled:
+            return
+
+        def on_response(response, *args, **kwargs):
+            duration = response.elapsed.total_seconds()
+            path = response.request.path_url.split('?')[0]
+            path = DOCKER_ID.sub('/{id}', DOCKER_VERSION.sub('', path))
+            self.add(
+                'docker {} {}'.format(response.request.method, path),
+                time.time() - duration,
+                duration,
+                status=response.status_code,
+            )
+
+        api.hooks['response'].append(on_response)
+
+    def instrument_boto(self, client):
+        """
+        Records a span for each API call made with a boto3 client, lasting
+        until its response headers arrive.
+        """
+
+        if not self.enabled:
+            return
+
+        def starts():
+            if not hasattr(self._boto_starts, 'starts'):
+                self._boto_starts.starts = []
+            return self._boto_starts.starts
+
+        def before_call(params=None, **kwargs):
+            starts().append((
+                time.time(),
+                body_size((params or {}).get('body')),
+            ))
+
+        # Calls which raise may skip after-call, but as a stack the starts
+        # still pair up with the right calls.
+        def after_call(event_name=None, parsed=None, **kwargs):
+            if not starts():
+                return
+            start, sent = starts().pop()
+            args = {}
+            if sent:
+                args['bytes'] = sent
+            elif isinstance(parsed, dict) and parsed.get('ContentLength'):
+                args['bytes'] = parsed['ContentLength']
+            if event_name.startswith('after-call-error'):
+                args['error'] = True
+            # after-call.<service>.<operation>
+            _, service, operation = event_name.split('.', 2)
+            self.add(
+                '{} {}'.format(service, operation),
+                start,
+                time.time() - start,
+                **args
+            )
+
+        # First, as handlers which return a response skip the rest.
+        events = client.meta.events
+        events.register_first('before-call.*.*', before_call)
+        events.register('after-call.*.*', after_call)
+        events.register('after-call-error.*.*', after_call)
+
+    def summary(self):
+        """
+        Returns a table of the total and longest time spent in spans of each
+        name, in the order they first started.
+        """
+
+        totals = collections.OrderedDict()
+        for name, start, duration, _, args in sorted(
+            self.spans,
+            key=lambda span: span[1],
+        ):
+            total = totals.setdefault(name, [0, 0.0, 0.0, 0])
+            total[0] += 1
+            total[1] += duration
+            total[2] = max(total[2], duration)
+            total[3] += args.get('bytes', 0)
+
+        lines = [
+            "Timings ({:.1f} ms in total):".format(
+                (time.time() - self.started) * 1000,
+            ),
+            "  {:<40} {:>6} {:>10} {:>10} {:>9}".format(
+                'phase',
+                'count',
+                'total ms',
+                'max ms',
+                'MB',
+            ),
+        ]
+        for name, (count, total, longest, size) in totals.items():
+            lines.append("  {:<40} {:>6} {:>10.1f} {:>10.1f} {:>9}".format(
+                name[:40],
+                count,
+                total * 1000,
+                longest * 1000,
+                '{:.1f}'.format(size / 1024 / 1024) if size else '-',
+            ))
+        for name, value in sorted(self.counters.items()):
+            lines.append("  {}: {}".format(name, value))
+        return '\n'.join(lines)
+
+    def trace(self):
+        """
+        Returns the spans in Chrome's trace event format, which can be loaded
+        into chrome://tracing or Perfetto.
+        """
+
+        pid = os.getpid()
+        thread_ids = {}
+        events = []
+        for name, start, duration, thread_name, args in self.spans:
+            if thread_name not in thread_ids:
+                thread_ids[thread_name] = len(thread_ids)
+                events.append({
+                    'name': 'thread_name',
+                    'ph': 'M',
+                    'pid': pid,
+                    'tid': thread_ids[thread_name],
+                    'args': {'name': thread_name},
+                })
+            events.append({
+                'name': name,
+                'cat': name.split(' ')[0].split('.')[0],
+                'ph': 'X',
+                'ts': round((start - self.started) * 1000000),
+                'dur': round(duration * 1000000),
+                'pid': pid,
+                'tid': thread_ids[thread_name],
+                'args': args,
+            })
+        return {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': dict(self.counters),
+        }
+
+    def write_trace(self, path):
+        with open(path, 'w') as trace_f:
+            json.dump(self.trace(), trace_f)
+
+
+TIMINGS = Timings()
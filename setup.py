@@ -14,11 +14,15 @@ setup(
     install_requires=[
         'Click',
         'docker',
-        'paramiko',
+        'paramiko>=3.2',
         'boto3<1.7',
+        'cryptography',
         'PyYAML',
         'python-dateutil<2.7.0',
     ],
+    extras_require={
+        'zstd': ['zstandard'],
+    },
     entry_points='''
         [console_scripts]
         hermes=hermes_cli.scripts.hermes:cli